@@ -1,120 +1,623 @@
 import socket
 import sys
 import os
+import time
+import codecs
+import threading
+import queue
+import argparse
+import urllib.parse
+from html.parser import HTMLParser
 from pathlib import Path
 
-class HTTPClient:
+# Response heads larger than this are rejected
+MAX_HEADER_SIZE = 64 * 1024
+
+# Attempts per request when the server answers 429 or 503
+MAX_ATTEMPTS = 5
+
+# Segmented downloads never split a file into pieces smaller than this
+MIN_SEGMENT_SIZE = 256 * 1024
+
+class LinkParser(HTMLParser):
+    # Collects the href of every <a> in a directory listing page
     def __init__(self):
+        super().__init__()
+        self.links = []
+    
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self.links.append(href)
+
+class ConnectionPool:
+    # Idle keep-alive connections per (host, port), shared by the mirror
+    # workers so each file does not pay for a new TCP handshake
+    def __init__(self, timeout=10, max_idle_per_host=16):
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.idle = {}
+        self.lock = threading.Lock()
+    
+    def get(self, host, port):
+        # Returns (sock, reused)
+        with self.lock:
+            connections = self.idle.get((host, port))
+            if connections:
+                return connections.pop(), True
+        return socket.create_connection((host, port), timeout=self.timeout), False
+    
+    def put(self, host, port, sock):
+        with self.lock:
+            connections = self.idle.setdefault((host, port), [])
+            if len(connections) < self.max_idle_per_host:
+                connections.append(sock)
+                return
+        sock.close()
+    
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for sock in connections:
+                    sock.close()
+            self.idle.clear()
+
+class MirrorStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.downloaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+    
+    def add(self, downloaded=0, skipped=0, failed=0, size=0):
+        with self.lock:
+            self.downloaded += downloaded
+            self.skipped += skipped
+            self.failed += failed
+            self.bytes += size
+    
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.bytes / max(elapsed, 1e-6) / (1024 * 1024)
+        return (f"Downloaded {self.downloaded} files ({self.bytes / (1024 * 1024):.1f} MiB) in {elapsed:.1f}s, "
+                f"{rate:.1f} MiB/s; skipped {self.skipped} up to date, {self.failed} failed")
+
+class HTTPClient:
+    def __init__(self, buffer_size=256 * 1024):
         self.supported_binary_types = ['image/png', 'application/pdf']
+        
+        # One receive buffer reused for every read, so memory stays flat
+        # whatever the size of the download
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
     
-    def download(self, server_host, server_port, url_path, save_directory):
+    def download(self, server_host, server_port, url_path, save_directory, segments=1):
         try:
             # Create save directory if it doesn't exist
             save_path = Path(save_directory)
             save_path.mkdir(parents=True, exist_ok=True)
             
-            # Connect to server
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                sock.settimeout(10)
-                sock.connect((server_host, server_port))
-                
-                # Send HTTP request
-                request = f"GET {url_path} HTTP/1.1\r\n"
-                request += f"Host: {server_host}:{server_port}\r\n"
-                request += "Connection: close\r\n\r\n"
-                
-                sock.send(request.encode('utf-8'))
-                
-                # Receive response
-                response = b""
-                while True:
-                    chunk = sock.recv(4096)
-                    if not chunk:
-                        break
-                    response += chunk
-                
-                # Parse response
-                header_end = response.find(b"\r\n\r\n")
-                if header_end == -1:
-                    print("Invalid response from server")
-                    return
-                
-                headers = response[:header_end].decode('utf-8')
-                body = response[header_end + 4:]
-                
-                # Parse status line
-                status_line = headers.split('\r\n')[0]
-                status_parts = status_line.split()
-                if len(status_parts) < 2:
-                    print("Invalid status line")
-                    return
+            if segments > 1 and self.download_segmented(server_host, server_port, url_path, save_path, segments):
+                return
+            
+            # A .part file left by an interrupted download is continued
+            # with a range request instead of starting over. If-Range makes
+            # the server send the whole file instead if it has changed since
+            resume_path = self.partial_download(save_path, url_path)
+            validator = self.saved_validator(resume_path) if resume_path else None
+            if resume_path and validator is None:
+                print(f"Discarding {resume_path}, the version it came from is unknown")
+                resume_path.unlink()
+                resume_path = None
+            offset = resume_path.stat().st_size if resume_path else 0
+            extra_headers = [('Range', f'bytes={offset}-'), ('If-Range', validator)] if offset else []
+            
+            with self.open_request(server_host, server_port, url_path, extra_headers) as sock:
+                # Headers first; the body is streamed afterwards
+                status_code, headers, body_start = self.read_head(sock)
+                content_length = self.content_length(headers)
                 
-                status_code = int(status_parts[1])
+                if status_code == 416 and offset:
+                    # The partial file is as long as the remote one, or longer
+                    print(f"Discarding {resume_path}, it does not match the file on the server")
+                    resume_path.unlink()
+                    return self.download(server_host, server_port, url_path, save_directory)
                 
-                if status_code != 200:
+                if status_code == 206 and offset:
+                    if not headers.get('content-range', '').startswith(f'bytes {offset}-'):
+                        raise ValueError(f"Unexpected Content-Range: {headers.get('content-range')}")
+                    if self.validator(headers) != validator:
+                        raise ValueError(f"{url_path} changed on the server, partial download left in {resume_path}")
+                elif status_code != 200:
                     print(f"Server returned status: {status_code}")
-                    if body:
-                        print(body.decode('utf-8', errors='ignore'))
+                    self.print_body(sock, body_start, content_length)
                     return
+                else:
+                    # 200 to a range request: the server sent the whole file
+                    offset = 0
                 
-                # Parse headers
-                content_type = None
-                for line in headers.split('\r\n')[1:]:
-                    if line.lower().startswith('content-type:'):
-                        content_type = line.split(':', 1)[1].strip()
-                        break
+                content_type = headers.get('content-type')
                 
                 # Handle based on content type
                 if content_type and any(ct in content_type for ct in self.supported_binary_types):
-                    # Extract filename from URL
-                    filename = os.path.basename(url_path)
-                    if not filename or filename == '/':
-                        filename = 'downloaded_file'
-                    
-                    # Add appropriate extension if missing
-                    if content_type == 'image/png' and not filename.lower().endswith('.png'):
-                        filename += '.png'
-                    elif content_type == 'application/pdf' and not filename.lower().endswith('.pdf'):
-                        filename += '.pdf'
-                    
-                    file_path = save_path / filename
-                    
-                    # Save binary file
-                    with open(file_path, 'wb') as f:
-                        f.write(body)
+                    file_path = save_path / self.target_filename(url_path, content_type)
+                    if offset:
+                        if file_path.with_name(file_path.name + '.part') != resume_path:
+                            raise ValueError(f"Server sent {content_type} for {resume_path}")
+                        print(f"Resuming from byte {offset}")
+                    size = self.save_body(sock, body_start, content_length, file_path, offset=offset,
+                                          validator=self.validator(headers))
                     
                     print(f"File saved: {file_path}")
-                    print(f"Size: {len(body)} bytes")
-                    
+                    print(f"Size: {size} bytes")
+                
                 else:
                     # Assume HTML or text, print to console
-                    try:
-                        text_content = body.decode('utf-8')
-                        print(text_content)
-                    except UnicodeDecodeError:
-                        print("Received binary content of unsupported type")
-                        print(f"Content-Type: {content_type}")
-                        print(f"Size: {len(body)} bytes")
-                        
+                    self.print_body(sock, body_start, content_length)
+        
         except socket.timeout:
             print("Connection timeout")
         except ConnectionRefusedError:
             print(f"Could not connect to {server_host}:{server_port}")
         except Exception as e:
             print(f"Error: {e}")
+    
+    def open_request(self, host, port, url_path, extra_headers=()):
+        # Connects and sends a GET; the caller reads the response and
+        # closes the socket
+        sock = socket.create_connection((host, port), timeout=10)
+        try:
+            request = f"GET {url_path} HTTP/1.1\r\n"
+            request += f"Host: {host}:{port}\r\n"
+            request += ''.join(f"{name}: {value}\r\n" for name, value in extra_headers)
+            request += "Connection: close\r\n\r\n"
+            sock.sendall(request.encode('utf-8'))
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+    
+    def target_filename(self, url_path, content_type):
+        # Extract filename from URL
+        filename = os.path.basename(urllib.parse.urlsplit(url_path).path)
+        if not filename or filename == '/':
+            filename = 'downloaded_file'
+        
+        # Add appropriate extension if missing
+        if content_type == 'image/png' and not filename.lower().endswith('.png'):
+            filename += '.png'
+        elif content_type == 'application/pdf' and not filename.lower().endswith('.pdf'):
+            filename += '.pdf'
+        return filename
+    
+    def partial_download(self, save_path, url_path):
+        # The .part file an earlier download of url_path left behind, if any.
+        # The saved name depends on the content type, so try each one.
+        for content_type in self.supported_binary_types:
+            part_path = save_path / (self.target_filename(url_path, content_type) + '.part')
+            if part_path.is_file() and part_path.stat().st_size > 0:
+                return part_path
+        return None
+    
+    def validator(self, headers):
+        # What If-Range can compare: a strong ETag, else Last-Modified
+        etag = headers.get('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return headers.get('last-modified')
+    
+    def validator_path(self, part_path):
+        return part_path.with_name(part_path.name + '.validator')
+    
+    def saved_validator(self, part_path):
+        # The validator of the response a .part file was started from
+        try:
+            return self.validator_path(part_path).read_text().strip() or None
+        except OSError:
+            return None
+    
+    def read_head(self, sock):
+        # Returns (status_code, headers, body_start): headers have lowercase
+        # names, body_start is whatever arrived after the blank line
+        received = 0
+        while True:
+            if received == len(self.buffer):
+                raise ValueError("Response headers too large")
+            read = sock.recv_into(self.view[received:min(len(self.buffer), MAX_HEADER_SIZE)])
+            if not read:
+                raise ValueError("Invalid response from server")
+            received += read
+            
+            header_end = self.buffer.find(b"\r\n\r\n", 0, received)
+            if header_end != -1:
+                break
+            if received >= MAX_HEADER_SIZE:
+                raise ValueError("Response headers too large")
+        
+        lines = self.buffer[:header_end].decode('iso-8859-1').split('\r\n')
+        body_start = bytes(self.buffer[header_end + 4:received])
+        
+        # Parse status line
+        status_parts = lines[0].split()
+        if len(status_parts) < 2 or not status_parts[1].isdigit():
+            raise ValueError("Invalid status line")
+        
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return int(status_parts[1]), headers, body_start
+    
+    def content_length(self, headers):
+        # None when the server did not say; the body then ends at close
+        value = headers.get('content-length')
+        return int(value) if value is not None and value.isdigit() else None
+    
+    def read_body(self, sock, body_start, content_length):
+        # Yields body chunks as memoryviews into the shared buffer (valid
+        # until the next chunk) and stops after content_length bytes
+        if body_start:
+            if content_length is not None:
+                body_start = body_start[:content_length]
+            yield memoryview(body_start)
+        
+        remaining = None if content_length is None else content_length - len(body_start)
+        while remaining is None or remaining > 0:
+            limit = len(self.buffer) if remaining is None else min(len(self.buffer), remaining)
+            read = sock.recv_into(self.view[:limit])
+            if not read:
+                return
+            if remaining is not None:
+                remaining -= read
+            yield self.view[:read]
+    
+    def save_body(self, sock, body_start, content_length, file_path, show_progress=True, offset=0,
+                  validator=None):
+        # Streams into file_path.part and renames it over file_path only once
+        # the whole body has arrived, so file_path is never half-written.
+        # With an offset the body is appended to the existing .part file.
+        # A new .part file gets the response's validator saved next to it,
+        # so a resume can tell whether the file changed in between.
+        temp_path = file_path.with_name(file_path.name + '.part')
+        validator_path = self.validator_path(temp_path)
+        expected = None if content_length is None else offset + content_length
+        progress = DownloadProgress(expected, enabled=show_progress)
+        size = offset
+        
+        if not offset:
+            if validator:
+                validator_path.write_text(validator + '\n')
+            elif validator_path.exists():
+                validator_path.unlink()
+        
+        with open(temp_path, 'ab' if offset else 'wb') as f:
+            for chunk in self.read_body(sock, body_start, content_length):
+                f.write(chunk)
+                size += len(chunk)
+                progress.update(size)
+        progress.finish(size)
+        
+        if expected is not None and size != expected:
+            raise ValueError(f"Connection closed after {size} of {expected} bytes, "
+                             f"partial download left in {temp_path}")
+        
+        os.replace(temp_path, file_path)
+        if validator_path.exists():
+            validator_path.unlink()
+        return size
+    
+    def print_body(self, sock, body_start, content_length):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        for chunk in self.read_body(sock, body_start, content_length):
+            sys.stdout.write(decoder.decode(chunk))
+        sys.stdout.write(decoder.decode(b'', final=True) + '\n')
+    
+    def download_segmented(self, host, port, url_path, save_path, segments):
+        # Fetches the file as `segments` byte ranges over parallel
+        # connections, each written at its offset into a preallocated
+        # .part file. Returns False, without downloading anything, when the
+        # server does not answer ranges, gives no validator or the file is
+        # not one we save, so the caller falls back to a single download.
+        # Every segment is sent with If-Range, so a file that changes midway
+        # fails the download instead of mixing two versions.
+        with self.open_request(host, port, url_path, [('Range', 'bytes=0-0')]) as sock:
+            status_code, headers, body_start = self.read_head(sock)
+            self.discard_body(sock, body_start, self.content_length(headers))
+        
+        content_type = headers.get('content-type')
+        total = headers.get('content-range', '').rpartition('/')[2]
+        validator = self.validator(headers)
+        if status_code != 206 or not total.isdigit() or not content_type or not validator or \
+                not any(ct in content_type for ct in self.supported_binary_types):
+            return False
+        
+        total = int(total)
+        segments = min(segments, total // MIN_SEGMENT_SIZE)
+        if segments < 2:
+            return False
+        
+        file_path = save_path / self.target_filename(url_path, content_type)
+        temp_path = file_path.with_name(file_path.name + '.part')
+        segment_size = -(-total // segments)
+        bounds = [(start, min(start + segment_size, total) - 1) for start in range(0, total, segment_size)]
+        progress = DownloadProgress(total)
+        errors = []
+        
+        def fetch(start, end):
+            try:
+                # Each thread needs its own receive buffer
+                HTTPClient().fetch_segment(host, port, url_path, fd, start, end, progress, validator)
+            except Exception as e:
+                errors.append(f"bytes {start}-{end}: {e}")
+        
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fd, 0, total)
+            else:
+                os.ftruncate(fd, total)
+            
+            threads = [threading.Thread(target=fetch, args=bound) for bound in bounds]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            os.close(fd)
+        progress.finish(progress.done)
+        
+        # Holes in a segmented .part file cannot be resumed, so drop it
+        if errors or progress.done != total or os.path.getsize(temp_path) != total:
+            os.remove(temp_path)
+            raise ValueError(f"Segmented download failed: {'; '.join(errors) or 'size mismatch'}")
+        
+        os.replace(temp_path, file_path)
+        print(f"File saved: {file_path}")
+        print(f"Size: {total} bytes ({len(bounds)} segments)")
+        return True
+    
+    def fetch_segment(self, host, port, url_path, fd, start, end, progress, validator):
+        # A 200 here means If-Range did not match: the file has changed
+        extra_headers = [('Range', f'bytes={start}-{end}'), ('If-Range', validator)]
+        with self.open_request(host, port, url_path, extra_headers) as sock:
+            status_code, headers, body_start = self.read_head(sock)
+            if status_code == 200 or (status_code == 206 and self.validator(headers) != validator):
+                raise ValueError(f"{url_path} changed on the server during the download")
+            if status_code != 206 or not headers.get('content-range', '').startswith(f'bytes {start}-{end}/'):
+                raise ValueError(f"Server returned status: {status_code}")
+            
+            offset = start
+            for chunk in self.read_body(sock, body_start, end - start + 1):
+                while chunk:
+                    written = os.pwrite(fd, chunk, offset)
+                    offset += written
+                    chunk = chunk[written:]
+                    progress.add(written)
+        
+        if offset != end + 1:
+            raise ValueError(f"Connection closed after {offset - start} of {end - start + 1} bytes")
+    
+    def discard_body(self, sock, body_start, content_length):
+        for _ in self.read_body(sock, body_start, content_length):
+            pass
+    
+    def pooled_get(self, pool, host, port, url_path, handle_body, extra_headers=()):
+        # GET over a pooled keep-alive connection. handle_body(sock, status,
+        # headers, body_start, content_length) must consume the whole body;
+        # its result is returned. 429 and 503 are retried after Retry-After.
+        request = f"GET {url_path} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+        request += ''.join(f"{name}: {value}\r\n" for name, value in extra_headers)
+        request = (request + "Connection: keep-alive\r\n\r\n").encode('utf-8')
+        
+        for attempt in range(MAX_ATTEMPTS):
+            sock, reused = pool.get(host, port)
+            try:
+                try:
+                    sock.sendall(request)
+                    status_code, headers, body_start = self.read_head(sock)
+                except (OSError, ValueError):
+                    if not reused:
+                        raise
+                    # The server closed the idle connection; try a fresh one
+                    sock.close()
+                    sock, reused = socket.create_connection((host, port), timeout=pool.timeout), False
+                    sock.sendall(request)
+                    status_code, headers, body_start = self.read_head(sock)
+                
+                content_length = self.content_length(headers)
+                if status_code in (429, 503) and attempt < MAX_ATTEMPTS - 1:
+                    self.discard_body(sock, body_start, content_length)
+                    result = None
+                else:
+                    result = handle_body(sock, status_code, headers, body_start, content_length)
+            except BaseException:
+                sock.close()
+                raise
+            
+            if content_length is None or 'close' in headers.get('connection', '').lower():
+                sock.close()
+            else:
+                pool.put(host, port, sock)
+            
+            if status_code not in (429, 503) or attempt == MAX_ATTEMPTS - 1:
+                return result
+            retry_after = headers.get('retry-after', '')
+            time.sleep(int(retry_after) if retry_after.isdigit() else attempt + 1)
+    
+    def mirror(self, server_host, server_port, url_path, save_directory, workers=4):
+        # Walks the directory listings under url_path (following pagination
+        # links) and downloads every file into save_directory, with
+        # `workers` threads sharing one pool of keep-alive connections.
+        # Files already on disk with the server's size are skipped.
+        root = url_path if url_path.endswith('/') else url_path + '/'
+        save_path = Path(save_directory)
+        save_path.mkdir(parents=True, exist_ok=True)
+        
+        pool = ConnectionPool()
+        stats = MirrorStats()
+        tasks = queue.Queue()
+        seen = {root}
+        seen_lock = threading.Lock()
+        tasks.put(root)
+        
+        def enqueue(target):
+            with seen_lock:
+                if target in seen:
+                    return
+                seen.add(target)
+            tasks.put(target)
+        
+        def work():
+            # Every worker has its own client, and so its own receive buffer
+            client = HTTPClient()
+            while True:
+                target = tasks.get()
+                if target is None:
+                    return
+                try:
+                    if urllib.parse.urlsplit(target).path.endswith('/'):
+                        for link in client.fetch_listing(pool, server_host, server_port, target):
+                            enqueue(link)
+                    else:
+                        client.mirror_file(pool, server_host, server_port, target, root, save_path, stats)
+                except Exception as e:
+                    print(f"Error: {target}: {e}")
+                    stats.add(failed=1)
+                finally:
+                    tasks.task_done()
+        
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            tasks.join()
+        finally:
+            for _ in threads:
+                tasks.put(None)
+            for thread in threads:
+                thread.join()
+            pool.close()
+        
+        print(stats.summary())
+        return stats
+    
+    def fetch_listing(self, pool, host, port, listing_url):
+        # Returns the links on a listing page that point into the listed
+        # directory: files, subdirectories and the other pages of the same
+        # listing. The parent link never matches.
+        def handle_body(sock, status_code, headers, body_start, content_length):
+            body = b''.join(bytes(chunk) for chunk in self.read_body(sock, body_start, content_length))
+            if status_code != 200:
+                raise ValueError(f"Server returned status: {status_code}")
+            return body
+        
+        parser = LinkParser()
+        parser.feed(self.pooled_get(pool, host, port, listing_url, handle_body).decode('utf-8', errors='replace'))
+        
+        listing_path = urllib.parse.urlsplit(listing_url).path
+        links = []
+        for href in parser.links:
+            link = urllib.parse.urljoin(listing_url, href)
+            if urllib.parse.urlsplit(link).path.startswith(listing_path):
+                links.append(link)
+        return links
+    
+    def mirror_file(self, pool, host, port, file_url, root, save_path, stats):
+        relative = Path(urllib.parse.unquote(urllib.parse.urlsplit(file_url).path[len(root):]))
+        if '..' in relative.parts or relative.is_absolute():
+            raise ValueError("Refusing to write outside the mirror directory")
+        file_path = save_path / relative
+        
+        if file_path.is_file() and self.remote_size(pool, host, port, file_url) == file_path.stat().st_size:
+            stats.add(skipped=1)
+            return
+        
+        def handle_body(sock, status_code, headers, body_start, content_length):
+            if status_code != 200:
+                self.discard_body(sock, body_start, content_length)
+                raise ValueError(f"Server returned status: {status_code}")
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            return self.save_body(sock, body_start, content_length, file_path, show_progress=False,
+                                  validator=self.validator(headers))
+        
+        size = self.pooled_get(pool, host, port, file_url, handle_body)
+        stats.add(downloaded=1, size=size)
+    
+    def remote_size(self, pool, host, port, file_url):
+        # Asks for the first byte only; the total size is in Content-Range.
+        # None when the server ignores ranges (then the full file is fetched)
+        def handle_body(sock, status_code, headers, body_start, content_length):
+            self.discard_body(sock, body_start, content_length)
+            if status_code == 206:
+                total = headers.get('content-range', '').rpartition('/')[2]
+                return int(total) if total.isdigit() else None
+            if status_code == 200:
+                return content_length
+            return None
+        
+        return self.pooled_get(pool, host, port, file_url, handle_body, [('Range', 'bytes=0-0')])
 
-def main():
-    if len(sys.argv) != 5:
-        print("Usage: python client.py server_host server_port url_path directory")
-        sys.exit(1)
+class DownloadProgress:
+    # One-line progress report on stderr, redrawn at most every interval
+    # seconds so printing never slows the download down
+    def __init__(self, total, interval=0.2, enabled=True):
+        self.total = total
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_update = 0
+        self.enabled = enabled and sys.stderr.isatty()
+        
+        # Running total for segmented downloads, fed from several threads
+        self.done = 0
+        self.lock = threading.Lock()
     
-    server_host = sys.argv[1]
-    server_port = int(sys.argv[2])
-    url_path = sys.argv[3]
-    save_directory = sys.argv[4]
+    def add(self, amount):
+        with self.lock:
+            self.done += amount
+            self.update(self.done)
+    
+    def update(self, done):
+        now = time.monotonic()
+        if not self.enabled or now - self.last_update < self.interval:
+            return
+        self.last_update = now
+        
+        rate = done / max(now - self.started, 1e-6) / (1024 * 1024)
+        if self.total:
+            line = f"{done / (1024 * 1024):.1f} / {self.total / (1024 * 1024):.1f} MiB ({done * 100 // self.total}%)"
+        else:
+            line = f"{done / (1024 * 1024):.1f} MiB"
+        sys.stderr.write(f"\r{line}, {rate:.1f} MiB/s ")
+        sys.stderr.flush()
+    
+    def finish(self, done):
+        if self.enabled:
+            self.last_update = 0
+            self.update(done)
+            sys.stderr.write("\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Download a file, or mirror a directory, over HTTP")
+    parser.add_argument('server_host')
+    parser.add_argument('server_port', type=int)
+    parser.add_argument('url_path')
+    parser.add_argument('directory')
+    parser.add_argument('--mirror', action='store_true',
+                        help="download everything listed under url_path, recursively")
+    parser.add_argument('--jobs', type=int, default=4,
+                        help="parallel downloads in mirror mode (default: 4)")
+    parser.add_argument('--segments', type=int, default=1,
+                        help="download one file as this many parallel byte ranges (default: 1)")
+    args = parser.parse_args()
     
     client = HTTPClient()
-    client.download(server_host, server_port, url_path, save_directory)
+    if args.mirror:
+        client.mirror(args.server_host, args.server_port, args.url_path, args.directory, args.jobs)
+    else:
+        client.download(args.server_host, args.server_port, args.url_path, args.directory, args.segments)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
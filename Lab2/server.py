@@ -5,171 +5,2374 @@ import mimetypes
 from pathlib import Path
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import uuid
+import email.utils
+import gzip
+import zlib
+import html
+import urllib.parse
+import argparse
+import hashlib
+import mmap
+import multiprocessing
+import signal
+import struct
+import bisect
+import json
+import stat
+import ctypes
+import ctypes.util
+from collections import OrderedDict, deque
+import queue
+import selectors
+import select
+import heapq
+import weakref
+
+STATUS_MESSAGES = {
+    200: "OK",
+    206: "Partial Content",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    408: "Request Timeout",
+    414: "URI Too Long",
+    416: "Range Not Satisfiable",
+    429: "Too Many Requests",
+    431: "Request Header Fields Too Large",
+    503: "Service Unavailable"
+}
+
+# Chunk size for the buffered fallback when os.sendfile is not available
+FILE_CHUNK_SIZE = 64 * 1024
+
+# More ranges than this in one request is treated as abuse and ignored
+MAX_RANGES = 16
+
+# Encoded "HTTP/1.1 <code> <message>" lines, filled in as they are used
+STATUS_LINES = {}
+
+# Only text is worth compressing; PNG and PDF are already compressed
+COMPRESSIBLE_TYPES = ['text/html', 'text/plain']
+MIN_COMPRESS_SIZE = 512
+
+# Internal endpoint, answered before the path is mapped onto the directory
+METRICS_PATH = '/__metrics'
+
+class HTTPParseError(Exception):
+    def __init__(self, status_code):
+        super().__init__(STATUS_MESSAGES[status_code])
+        self.status_code = status_code
+
+class DeadlineExceeded(Exception):
+    # kind is one of ConnectionDeadlines.KINDS
+    def __init__(self, kind):
+        super().__init__(f"{kind} deadline exceeded")
+        self.kind = kind
+
+class Headers(dict):
+    # Header names are stored lowercased; lookups accept any case
+    def __getitem__(self, name):
+        return super().__getitem__(name.lower())
+    
+    def __contains__(self, name):
+        return super().__contains__(name.lower())
+    
+    def get(self, name, default=None):
+        return super().get(name.lower(), default)
+
+class Request:
+    def __init__(self, method, target, path, query, version, headers):
+        self.method = method
+        self.target = target
+        self.path = path
+        self.query = query
+        self.version = version
+        self.headers = headers
+        # Time spent parsing the request head, for the metrics
+        self.parse_seconds = 0.0
+
+class RequestParser:
+    # Incremental parser for HTTP/1.x request heads. Bytes are appended to
+    # one bytearray that lives as long as the connection; next_request()
+    # returns None until a complete head has arrived, so requests split
+    # across TCP segments and pipelined requests both work. Limits on the
+    # request line and header block are enforced as the bytes arrive, so an
+    # oversized request is rejected (414/431) without buffering all of it.
+    # Used by every server mode: blocking servers call receive(), the event
+    # loop calls feed() with what its reader returned.
+    # receive() reads into one buffer per thread (the poller and each
+    # worker) instead of one per connection, so an idle connection only
+    # holds the bytes it has actually sent.
+    read_buffers = threading.local()
+    
+    def __init__(self, max_request_line=8190, max_header_size=16384, read_size=65536):
+        self.max_request_line = max_request_line
+        self.max_header_size = max_header_size
+        self.read_size = read_size
+        self.buffer = bytearray()
+        # Bytes of a request body still to be discarded (GET bodies are ignored)
+        self.body_remaining = 0
+    
+    def feed(self, data):
+        self.buffer += data
+    
+    def receive(self, client_socket):
+        # Returns False once the peer has closed the connection
+        try:
+            read_buffer = self.read_buffers.buffer
+        except AttributeError:
+            read_buffer = None
+        if read_buffer is None or len(read_buffer) < self.read_size:
+            read_buffer = self.read_buffers.buffer = memoryview(bytearray(self.read_size))
+        
+        received = client_socket.recv_into(read_buffer, self.read_size)
+        if not received:
+            return False
+        self.buffer += read_buffer[:received]
+        return True
+    
+    def next_request(self):
+        if self.body_remaining:
+            discarded = min(self.body_remaining, len(self.buffer))
+            del self.buffer[:discarded]
+            self.body_remaining -= discarded
+            if self.body_remaining:
+                return None
+        
+        line_end = self.buffer.find(b'\r\n', 0, self.max_request_line + 2)
+        if line_end == -1:
+            if len(self.buffer) > self.max_request_line:
+                raise HTTPParseError(414)
+            return None
+        
+        head_end = self.buffer.find(b'\r\n\r\n', line_end, line_end + self.max_header_size + 4)
+        if head_end == -1:
+            if len(self.buffer) - line_end > self.max_header_size:
+                raise HTTPParseError(431)
+            return None
+        
+        request = self.parse_head(line_end, head_end)
+        del self.buffer[:head_end + 4]
+        
+        content_length = request.headers.get('content-length')
+        if content_length is not None:
+            try:
+                self.body_remaining = int(content_length)
+            except ValueError:
+                raise HTTPParseError(400)
+            if self.body_remaining < 0:
+                raise HTTPParseError(400)
+        elif 'transfer-encoding' in request.headers:
+            # A chunked body cannot be skipped without decoding it
+            raise HTTPParseError(400)
+        
+        return request
+    
+    def parse_head(self, line_end, head_end):
+        parts = self.buffer[:line_end].split(b' ')
+        if len(parts) != 3 or not parts[2].startswith(b'HTTP/'):
+            raise HTTPParseError(400)
+        
+        method = parts[0].decode('ascii', 'replace')
+        target = parts[1].decode('utf-8', 'replace')
+        version = parts[2].decode('ascii', 'replace')
+        
+        headers = Headers()
+        position = line_end + 2
+        while position < head_end:
+            next_line = self.buffer.find(b'\r\n', position, head_end + 2)
+            colon = self.buffer.find(b':', position, next_line)
+            if colon <= position:
+                raise HTTPParseError(400)
+            name = self.buffer[position:colon].decode('latin-1').strip().lower()
+            value = self.buffer[colon + 1:next_line].decode('latin-1').strip()
+            # Repeated headers are combined as a comma-separated list
+            headers[name] = f"{headers[name]}, {value}" if name in headers else value
+            position = next_line + 2
+        
+        # Absolute-form targets (http://host/path) carry the path after the authority
+        if target.startswith(('http://', 'https://')):
+            target = urllib.parse.urlsplit(target)._replace(scheme='', netloc='').geturl() or '/'
+        
+        raw_path, _, query = target.partition('?')
+        path = urllib.parse.unquote(raw_path, errors='replace')
+        return Request(method, target, path, query, version, headers)
+
+class Response:
+    # A response is built once and can be written by either the blocking
+    # socket servers or the event-loop server. The body is a list of
+    # segments: bytes are sent as-is, (offset, length) pairs are slices of
+    # file_path that are streamed from disk when the response is written.
+    def __init__(self, status_code, status_message=None, content_type='text/html; charset=utf-8',
+                 body=b'', file_path=None, segments=None, headers=None, entity_header=None):
+        self.status_code = status_code
+        self.status_message = status_message or STATUS_MESSAGES.get(status_code, "")
+        self.content_type = content_type
+        self.body = body
+        self.file_path = file_path
+        self.segments = [body] if segments is None else segments
+        self.headers = headers or []
+        self.content_length = sum(
+            len(segment) if isinstance(segment, bytes) else segment[1]
+            for segment in self.segments
+        )
+        # Pre-encoded Content-Type/Content-Length/extra header lines, e.g.
+        # from the content cache
+        self.entity_header = entity_header
+    
+    def entity_header_bytes(self):
+        if self.entity_header is None:
+            headers = ""
+            # 304 responses carry no body and describe none
+            if self.status_code != 304:
+                headers += f"Content-Type: {self.content_type}\r\n"
+                headers += f"Content-Length: {self.content_length}\r\n"
+            for name, value in self.headers:
+                headers += f"{name}: {value}\r\n"
+            self.entity_header = headers.encode('utf-8')
+        return self.entity_header
+    
+    def header_bytes(self, connection_header=b"Connection: close\r\n"):
+        key = (self.status_code, self.status_message)
+        status_line = STATUS_LINES.get(key)
+        if status_line is None:
+            status_line = STATUS_LINES[key] = f"HTTP/1.1 {self.status_code} {self.status_message}\r\n".encode('utf-8')
+        return b"".join((status_line, self.entity_header_bytes(), connection_header, b"\r\n"))
+
+class ResponseWriter:
+    # Byte-level side of sending responses. The bytes that repeat from
+    # response to response are encoded once and reused: status lines (in
+    # STATUS_LINES), Connection/Keep-Alive headers, and the body and
+    # headers of every error page. Header and body leave in one sendmsg()
+    # scatter-gather call, looped until everything is written, so a small
+    # response is one syscall and one TCP segment.
+    def __init__(self):
+        self.close_header = b"Connection: close\r\n"
+        # (timeout, requests left on the connection) -> Connection + Keep-Alive bytes
+        self.keepalive_headers = {}
+        # (status code, message) -> (body, entity header bytes)
+        self.status_pages = {}
+        self.can_sendmsg = hasattr(socket.socket, 'sendmsg')
+    
+    def connection_header(self, keep_alive, timeout, requests_left):
+        if not keep_alive:
+            return self.close_header
+        
+        header = self.keepalive_headers.get((timeout, requests_left))
+        if header is None:
+            header = (f"Connection: keep-alive\r\n"
+                      f"Keep-Alive: timeout={timeout:g}, max={requests_left}\r\n").encode('utf-8')
+            self.keepalive_headers[(timeout, requests_left)] = header
+        return header
+    
+    def status_page(self, status_code, message):
+        # Returns (body, entity header) for an error page without extra headers
+        page = self.status_pages.get((status_code, message))
+        if page is None:
+            response = Response(status_code, status_message=message, body=self.status_page_body(status_code, message))
+            page = self.status_pages[(status_code, message)] = (response.body, response.entity_header_bytes())
+        return page
+    
+    def status_page_body(self, status_code, message):
+        html_content = f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <title>{status_code} {message}</title>
+        </head>
+        <body>
+            <h1>{status_code} {message}</h1>
+        </body>
+        </html>
+        """
+        return html_content.encode('utf-8')
+    
+    def send_buffers(self, client_socket, buffers, deadline, more=False):
+        # Writes every buffer, in order, within the SendDeadline. more=True
+        # tells the kernel more data follows (a sendfile body), so the
+        # headers are not pushed as a segment of their own.
+        try:
+            if not self.can_sendmsg:
+                data = b"".join(buffers)
+                deadline.arm(client_socket, len(data))
+                client_socket.sendall(data)
+                deadline.sent += len(data)
+                return
+            
+            flags = socket.MSG_MORE if more and hasattr(socket, 'MSG_MORE') else 0
+            views = [memoryview(buffer) for buffer in buffers if len(buffer)]
+            while views:
+                deadline.arm(client_socket)
+                sent = client_socket.sendmsg(views, [], flags)
+                deadline.sent += sent
+                # Drop what was written and retry with the rest
+                while sent:
+                    if sent >= len(views[0]):
+                        sent -= len(views[0])
+                        views.pop(0)
+                    else:
+                        views[0] = views[0][sent:]
+                        sent = 0
+        except socket.timeout:
+            raise DeadlineExceeded(deadline.kind)
+    
+    def send_available(self, client_socket, buffers):
+        # For a non-blocking socket: writes what fits in the socket buffer
+        # and returns the bytes that did not
+        try:
+            if self.can_sendmsg:
+                sent = client_socket.sendmsg(buffers)
+            else:
+                sent = client_socket.send(b"".join(buffers))
+        except BlockingIOError:
+            sent = 0
+        return b"".join(buffers)[sent:]
+
+class CacheEntry:
+    def __init__(self, mtime_ns, size, content_type, header, body):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.content_type = content_type
+        self.header = header
+        self.body = body
+        self.cost = len(header) + len(body)
+
+class ContentCache:
+    # Thread-safe LRU cache of file bodies and their pre-encoded headers,
+    # keyed by path. Entries are revalidated against the file's mtime and
+    # size on every lookup, so edits to the served directory show up on the
+    # next request. Files above max_entry_bytes are never cached so a large
+    # PDF cannot flush every small file out of the budget.
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entry_bytes=1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key, mtime_ns, size, count_miss=True):
+        # count_miss=False for lookups that are repeated on a miss
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += count_miss
+                return None
+            
+            if entry.mtime_ns != mtime_ns or entry.size != size:
+                # Stale: the file changed since it was cached
+                self.remove_entry(key)
+                self.misses += count_miss
+                return None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+    
+    def put(self, key, entry):
+        if entry.cost > self.max_entry_bytes or entry.cost > self.max_bytes:
+            return
+        
+        with self.lock:
+            if key in self.entries:
+                self.remove_entry(key)
+            
+            self.entries[key] = entry
+            self.current_bytes += entry.cost
+            
+            while self.current_bytes > self.max_bytes:
+                oldest_key = next(iter(self.entries))
+                self.remove_entry(oldest_key)
+                self.evictions += 1
+    
+    def remove_entry(self, key):
+        # Caller must hold self.lock
+        entry = self.entries.pop(key)
+        self.current_bytes -= entry.cost
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+class DirectoryListingCache:
+    # Sorted directory entries per directory, rebuilt only when the
+    # directory's mtime changes (an entry was added, removed or renamed).
+    # Each entry keeps its pre-rendered link HTML and the full path used for
+    # the request counter, so a listing only has to fill in the counts.
+    def __init__(self, max_directories=1024, file_index=None):
+        self.max_directories = max_directories
+        self.directories = OrderedDict()
+        self.lock = threading.Lock()
+        # When set, directory mtimes and contents come from the FileIndex
+        # instead of stat and scandir calls
+        self.file_index = file_index
+        
+        self.hits = 0
+        self.misses = 0
+    
+    def get_entries(self, directory_path, url_base, cached_only=False):
+        # cached_only returns None instead of building missing entries
+        key = str(directory_path)
+        index_entry = self.file_index.lookup(key) if self.file_index is not None else None
+        mtime_ns = index_entry.stat.st_mtime_ns if index_entry is not None else os.stat(directory_path).st_mtime_ns
+        
+        with self.lock:
+            cached = self.directories.get(key)
+            if cached is not None and cached[0] == mtime_ns:
+                self.directories.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            if cached_only:
+                return None
+            self.misses += 1
+        
+        items = self.file_index.list_directory(key) if self.file_index is not None else None
+        entries = self.scan_directory(directory_path, url_base, items)
+        
+        with self.lock:
+            self.directories[key] = (mtime_ns, entries)
+            self.directories.move_to_end(key)
+            while len(self.directories) > self.max_directories:
+                self.directories.popitem(last=False)
+        return entries
+    
+    def scan_directory(self, directory_path, url_base, items=None):
+        # items: sorted (name, is_dir, full_path) tuples if already known.
+        # scandir reports the entry type without a stat per entry
+        if items is None:
+            with os.scandir(directory_path) as scanner:
+                items = sorted((item.name, item.is_dir(), item.path) for item in scanner)
+        
+        entries = []
+        for name, is_dir, full_path in items:
+            suffix = '/' if is_dir else ''
+            href = urllib.parse.quote(url_base + name) + suffix
+            entries.append((f'<li><a href="{href}">{html.escape(name)}{suffix}</a>', full_path))
+        return entries
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.directories),
+            }
+
+class IndexEntry:
+    def __init__(self, file_stat, mime_type, checked):
+        self.stat = file_stat
+        self.is_dir = stat.S_ISDIR(file_stat.st_mode)
+        self.is_file = stat.S_ISREG(file_stat.st_mode)
+        self.mime_type = mime_type
+        # time.monotonic() of the stat, for revalidation when polling
+        self.checked = checked
+
+class FileIndex:
+    # In-memory metadata for the served tree: absolute path -> IndexEntry
+    # (stat result, type, MIME type), so a request costs a dict lookup
+    # instead of is_dir/is_file/stat calls. The tree is scanned with
+    # os.scandir by a background thread, so startup does not wait for it;
+    # until a directory is scanned, lookups below it fall back to os.stat.
+    # A path missing under a scanned directory is a miss without any
+    # syscall. Changes are picked up through inotify on Linux. Elsewhere
+    # (or when the watch limit is reached) directory mtimes are polled
+    # every poll_interval to find added and removed entries, and file
+    # entries older than poll_interval are re-stat'ed on lookup, which
+    # catches files rewritten in place.
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_ONLYDIR)
+    EVENT = struct.Struct('iIII')
+    
+    def __init__(self, root, guess_type, poll_interval=1.0, use_inotify=True):
+        self.root = str(root)
+        self.guess_type = guess_type
+        self.poll_interval = poll_interval
+        
+        # Readers use plain dict lookups; writers take self.lock
+        self.entries = {}
+        # Child names of every directory that has been scanned
+        self.directories = {}
+        self.lock = threading.Lock()
+        
+        self.libc = None
+        self.inotify_fd = self.open_inotify() if use_inotify else None
+        self.watches = {}
+    
+    def open_inotify(self):
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        return fd if fd >= 0 else None
+    
+    def start(self):
+        self.refresh_path(self.root, scan=False)
+        threading.Thread(target=self.run, daemon=True).start()
+    
+    def run(self):
+        self.scan_tree(self.root)
+        print(f"Indexed {len(self.entries)} paths under {self.root}")
+        if self.inotify_fd is not None:
+            self.watch_forever()
+        # No inotify, or it gave up
+        self.poll_forever()
+    
+    def lookup(self, path):
+        # Returns the IndexEntry for path, or None if it does not exist
+        key = str(path)
+        entry = self.entries.get(key)
+        if entry is not None:
+            if self.inotify_fd is None and not entry.is_dir and time.monotonic() - entry.checked > self.poll_interval:
+                return self.refresh_path(key, scan=False)
+            return entry
+        
+        # A miss is final if the closest indexed ancestor is a scanned
+        # directory, or a file
+        parent = os.path.dirname(key)
+        while parent not in self.entries and len(parent) > len(self.root):
+            parent = os.path.dirname(parent)
+        parent_entry = self.entries.get(parent)
+        if parent in self.directories or (parent_entry is not None and not parent_entry.is_dir):
+            return None
+        
+        # Not scanned yet, or below a symlinked directory (not followed)
+        try:
+            file_stat = os.stat(key)
+        except OSError:
+            return None
+        return IndexEntry(file_stat, None if stat.S_ISDIR(file_stat.st_mode) else self.guess_type(key),
+                          time.monotonic())
+    
+    def list_directory(self, path):
+        # Sorted (name, is_dir, full_path) for a scanned directory, else None
+        with self.lock:
+            names = self.directories.get(path)
+            if names is None:
+                return None
+            names = list(names)
+        
+        items = []
+        for name in names:
+            full_path = os.path.join(path, name)
+            entry = self.entries.get(full_path)
+            if entry is not None:
+                items.append((name, entry.is_dir, full_path))
+        return sorted(items)
+    
+    def make_entry(self, path, file_stat):
+        mime_type = None if stat.S_ISDIR(file_stat.st_mode) else self.guess_type(path)
+        return IndexEntry(file_stat, mime_type, time.monotonic())
+    
+    def refresh_path(self, path, scan=True):
+        # Re-stats one path and updates the index; new directories are
+        # scanned when scan is set. Returns the new entry or None.
+        try:
+            entry = self.make_entry(path, os.stat(path))
+        except OSError:
+            entry = None
+        
+        parent, name = os.path.split(path)
+        with self.lock:
+            siblings = self.directories.get(parent)
+            if entry is None:
+                self.remove_tree(path)
+                if siblings is not None:
+                    siblings.discard(name)
+                return None
+            
+            self.entries[path] = entry
+            if siblings is not None and path != self.root:
+                siblings.add(name)
+        
+        if scan and entry.is_dir and path not in self.directories:
+            self.scan_tree(path)
+        return entry
+    
+    def remove_tree(self, path):
+        # Caller must hold self.lock
+        self.entries.pop(path, None)
+        children = self.directories.pop(path, None)
+        for name in children or ():
+            self.remove_tree(os.path.join(path, name))
+    
+    def scan_tree(self, path):
+        pending = [path]
+        while pending:
+            pending.extend(self.scan_directory(pending.pop()))
+    
+    def scan_directory(self, directory):
+        # Indexes the children of one directory. Returns the subdirectories
+        # that have not been scanned yet; symlinked ones are not followed.
+        self.add_watch(directory)
+        entries = {}
+        subdirectories = []
+        try:
+            # Stat the directory first: a change during the scan then shows
+            # up as a newer mtime on the next poll
+            directory_stat = os.stat(directory)
+            with os.scandir(directory) as scanner:
+                for item in scanner:
+                    try:
+                        entries[item.path] = self.make_entry(item.path, item.stat())
+                    except OSError:
+                        continue
+                    if item.is_dir(follow_symlinks=False) and item.path not in self.directories:
+                        subdirectories.append(item.path)
+        except OSError:
+            with self.lock:
+                self.remove_tree(directory)
+            return []
+        
+        names = {os.path.basename(path) for path in entries}
+        with self.lock:
+            for name in self.directories.get(directory, set()) - names:
+                self.remove_tree(os.path.join(directory, name))
+            self.entries.update(entries)
+            self.entries[directory] = self.make_entry(directory, directory_stat)
+            self.directories[directory] = names
+        return subdirectories
+    
+    def poll_forever(self):
+        while True:
+            time.sleep(self.poll_interval)
+            for directory in list(self.directories):
+                entry = self.entries.get(directory)
+                try:
+                    mtime_ns = os.stat(directory).st_mtime_ns
+                except OSError:
+                    self.refresh_path(directory)
+                    continue
+                if entry is None or entry.stat.st_mtime_ns != mtime_ns:
+                    for subdirectory in self.scan_directory(directory):
+                        self.scan_tree(subdirectory)
+    
+    def add_watch(self, directory):
+        if self.inotify_fd is None:
+            return
+        wd = self.libc.inotify_add_watch(self.inotify_fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            print(f"Cannot watch {directory} ({os.strerror(ctypes.get_errno())}), polling for changes instead")
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+            return
+        self.watches[wd] = directory
+    
+    def watch_forever(self):
+        while self.inotify_fd is not None:
+            try:
+                data = os.read(self.inotify_fd, 65536)
+            except OSError:
+                return
+            
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_length = self.EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + self.EVENT.size:offset + self.EVENT.size + name_length].rstrip(b'\0'))
+                offset += self.EVENT.size + name_length
+                self.handle_event(wd, mask, name)
+    
+    def handle_event(self, wd, mask, name):
+        if mask & self.IN_Q_OVERFLOW:
+            # Events were lost; rescan everything
+            for directory in list(self.directories):
+                for subdirectory in self.scan_directory(directory):
+                    self.scan_tree(subdirectory)
+            return
+        
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+        if mask & self.IN_IGNORED:
+            # The directory was removed
+            del self.watches[wd]
+            return
+        
+        if name:
+            self.refresh_path(os.path.join(directory, name))
+        # The directory's own mtime versions its cached listing
+        self.refresh_path(directory, scan=False)
+    
+    def stats(self):
+        return {'entries': len(self.entries), 'watching': self.inotify_fd is not None}
+
+class ThreadExitToken:
+    # Kept in a threading.local; it is released when its thread exits, so
+    # a weakref.finalize on it runs cleanup for that thread
+    pass
+
+class ShardedCounter:
+    # Request counters without a global lock: every thread increments its
+    # own shard under the shard's lock, which no other writer ever takes, so
+    # the hot path never waits. Reads merge the shards lazily; snapshot()
+    # and get_many() hold every shard lock at once, so they see a
+    # consistent table. Counts stay exact because each increment is still a
+    # locked read-modify-write. When a thread exits (the elastic pool
+    # retires idle workers) its shard is folded into the first one, so the
+    # list stays as long as the number of live threads.
+    def __init__(self):
+        self.local = threading.local()
+        self.retired = (threading.Lock(), {})
+        self.shards = [self.retired]
+        self.shards_lock = threading.Lock()
+    
+    def own_shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = (threading.Lock(), {})
+            with self.shards_lock:
+                self.shards.append(shard)
+            self.local.shard = shard
+            self.local.exit_token = token = ThreadExitToken()
+            weakref.finalize(token, self.retire_shard, shard)
+            return shard
+    
+    def retire_shard(self, shard):
+        # Locks in list order, like the readers; the shard is emptied so a
+        # reader that listed it before the removal doesn't count twice
+        retired_lock, retired = self.retired
+        lock, counts = shard
+        with self.shards_lock:
+            with retired_lock, lock:
+                for key, count in counts.items():
+                    retired[key] = retired.get(key, 0) + count
+                counts.clear()
+            self.shards.remove(shard)
+    
+    def all_shards(self):
+        with self.shards_lock:
+            return list(self.shards)
+    
+    def increment(self, key, amount=1):
+        try:
+            lock, counts = self.local.shard
+        except AttributeError:
+            lock, counts = self.own_shard()
+        with lock:
+            counts[key] = counts.get(key, 0) + amount
+    
+    def increment_many(self, amounts):
+        # Several keys under a single acquire of the thread's own shard lock
+        try:
+            lock, counts = self.local.shard
+        except AttributeError:
+            lock, counts = self.own_shard()
+        with lock:
+            for key, amount in amounts:
+                counts[key] = counts.get(key, 0) + amount
+    
+    def get(self, key):
+        total = 0
+        for lock, counts in self.all_shards():
+            with lock:
+                total += counts.get(key, 0)
+        return total
+    
+    def get_many(self, keys):
+        shards = self.all_shards()
+        for lock, _ in shards:
+            lock.acquire()
+        try:
+            return [sum(counts.get(key, 0) for _, counts in shards) for key in keys]
+        finally:
+            for lock, _ in shards:
+                lock.release()
+    
+    def snapshot(self):
+        shards = self.all_shards()
+        for lock, _ in shards:
+            lock.acquire()
+        try:
+            merged = {}
+            for _, counts in shards:
+                for key, count in counts.items():
+                    merged[key] = merged.get(key, 0) + count
+            return merged
+        finally:
+            for lock, _ in shards:
+                lock.release()
+    
+    def set(self, key, value):
+        shards = self.all_shards()
+        own_lock, own_counts = self.own_shard()
+        for lock, _ in shards:
+            lock.acquire()
+        try:
+            for _, counts in shards:
+                counts.pop(key, None)
+            own_counts[key] = value
+        finally:
+            for lock, _ in shards:
+                lock.release()
+
+def stable_hash(key):
+    # Same value in every worker process (unlike hash(), which is salted per
+    # interpreter); 0 is reserved for empty shared-memory slots
+    digest = hashlib.blake2b(key.encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+class SharedStripeLocks:
+    # Process-shared locks for the stripes of a shared-memory table. Each
+    # lock records the pid holding it, so when a worker is killed while
+    # holding one (OOM killer, SIGKILL) the supervisor can release it with
+    # release_dead(). Until then acquire() gives up after `timeout` seconds
+    # and callers fail open (the request is allowed, the count skipped)
+    # rather than blocking forever; later attempts on a stripe that timed
+    # out do not wait at all until it is free again.
+    def __init__(self, count, timeout=1.0):
+        context = multiprocessing.get_context('fork')
+        self.locks = [context.Lock() for _ in range(count)]
+        self.owners = mmap.mmap(-1, count * 8)
+        self.timeout = timeout
+        self.stuck = set()
+        self.stuck_reported = False
+    
+    def acquire(self, stripe):
+        # Returns False if the lock could not be taken in time
+        if stripe in self.stuck:
+            if not self.locks[stripe].acquire(block=False):
+                return False
+            self.stuck.discard(stripe)
+        elif not self.locks[stripe].acquire(timeout=self.timeout):
+            self.stuck.add(stripe)
+            if not self.stuck_reported:
+                self.stuck_reported = True
+                print(f"Shared stripe lock {stripe} is held by pid "
+                      f"{struct.unpack_from('<q', self.owners, stripe * 8)[0]}, skipping it until released")
+            return False
+        struct.pack_into('<q', self.owners, stripe * 8, os.getpid())
+        return True
+    
+    def release(self, stripe):
+        struct.pack_into('<q', self.owners, stripe * 8, 0)
+        self.locks[stripe].release()
+    
+    def release_dead(self, pid):
+        # For the supervisor, once the worker `pid` has exited
+        released = 0
+        for stripe in range(len(self.locks)):
+            if struct.unpack_from('<q', self.owners, stripe * 8)[0] == pid:
+                self.release(stripe)
+                released += 1
+        return released
+
+class SharedCounterTable:
+    # Request counters for pre-fork mode, kept in an anonymous shared
+    # mapping created before the workers are forked so every process sees
+    # the same counts. It is an open-addressing hash table split into
+    # stripes, each guarded by its own process-shared lock. A slot holds the
+    # key hash, the count and up to 238 bytes of the key (used by
+    # snapshot(); longer keys are still counted and readable with get()).
+    # Same interface as ShardedCounter. A stripe whose lock is stuck reads
+    # as empty and drops increments.
+    SLOT = struct.Struct('<QqH238s')
+    
+    def __init__(self, capacity=65536, stripes=64):
+        self.stripe_count = stripes
+        self.slots_per_stripe = capacity // stripes
+        self.memory = mmap.mmap(-1, self.stripe_count * self.slots_per_stripe * self.SLOT.size)
+        self.locks = SharedStripeLocks(stripes)
+        self.full_reported = False
+    
+    def find_slot(self, key_hash, create=False):
+        # Caller must hold the stripe lock
+        stripe = key_hash % self.stripe_count
+        first_slot = stripe * self.slots_per_stripe
+        start = (key_hash // self.stripe_count) % self.slots_per_stripe
+        
+        for probe in range(self.slots_per_stripe):
+            offset = (first_slot + (start + probe) % self.slots_per_stripe) * self.SLOT.size
+            slot_hash = struct.unpack_from('<Q', self.memory, offset)[0]
+            if slot_hash == key_hash:
+                return offset
+            if slot_hash == 0:
+                return offset if create else None
+        return None
+    
+    def read_count(self, key_hash):
+        offset = self.find_slot(key_hash)
+        return 0 if offset is None else struct.unpack_from('<q', self.memory, offset + 8)[0]
+    
+    def write_count(self, key, key_hash, count):
+        offset = self.find_slot(key_hash, create=True)
+        if offset is None:
+            # Reported once per process rather than on every request
+            if not self.full_reported:
+                self.full_reported = True
+                print(f"Shared counter table is full, dropping counts for new paths such as {key}")
+            return
+        key_bytes = key.encode('utf-8', 'surrogateescape')[:238]
+        self.SLOT.pack_into(self.memory, offset, key_hash, count, len(key_bytes), key_bytes)
+    
+    def increment(self, key, amount=1):
+        key_hash = stable_hash(key)
+        stripe = key_hash % self.stripe_count
+        if not self.locks.acquire(stripe):
+            return
+        try:
+            self.write_count(key, key_hash, self.read_count(key_hash) + amount)
+        finally:
+            self.locks.release(stripe)
+    
+    def increment_many(self, amounts):
+        for key, amount in amounts:
+            self.increment(key, amount)
+    
+    def set(self, key, value):
+        key_hash = stable_hash(key)
+        stripe = key_hash % self.stripe_count
+        if not self.locks.acquire(stripe):
+            return
+        try:
+            self.write_count(key, key_hash, value)
+        finally:
+            self.locks.release(stripe)
+    
+    def get(self, key):
+        return self.get_many([key])[0]
+    
+    def lock_stripes(self, stripes):
+        # Locks are always taken in stripe order so readers cannot deadlock.
+        # Returns the stripes that were locked
+        return [stripe for stripe in sorted(stripes) if self.locks.acquire(stripe)]
+    
+    def get_many(self, keys):
+        key_hashes = [stable_hash(key) for key in keys]
+        locked = set(self.lock_stripes({key_hash % self.stripe_count for key_hash in key_hashes}))
+        try:
+            return [self.read_count(key_hash) if key_hash % self.stripe_count in locked else 0
+                    for key_hash in key_hashes]
+        finally:
+            for stripe in locked:
+                self.locks.release(stripe)
+    
+    def snapshot(self):
+        locked = self.lock_stripes(range(self.stripe_count))
+        try:
+            counts = {}
+            stripe_size = self.slots_per_stripe * self.SLOT.size
+            for stripe in locked:
+                for offset in range(stripe * stripe_size, (stripe + 1) * stripe_size, self.SLOT.size):
+                    key_hash, count, key_length, key_bytes = self.SLOT.unpack_from(self.memory, offset)
+                    if key_hash:
+                        counts[key_bytes[:key_length].decode('utf-8', 'surrogateescape')] = count
+            return counts
+        finally:
+            for stripe in locked:
+                self.locks.release(stripe)
+
+class SharedRateLimiter:
+    # Per-IP limiter state for pre-fork mode, in shared memory so a client
+    # is limited across all workers. The algorithm (token bucket or sliding
+    # window) is one of the limiters below; its per-client state list is
+    # loaded from and stored back into a fixed slot. Slots of clients idle
+    # longer than the limiter's idle_timeout are reused for new clients, so
+    # the table never needs a sweeper. If the table is full, or the
+    # stripe's lock is stuck, the request is allowed rather than rejected.
+    SLOT = struct.Struct('<Qddd')
+    
+    def __init__(self, limiter, capacity=65536, stripes=64):
+        self.limiter = limiter
+        self.stripe_count = stripes
+        self.slots_per_stripe = capacity // stripes
+        self.memory = mmap.mmap(-1, self.stripe_count * self.slots_per_stripe * self.SLOT.size)
+        self.locks = SharedStripeLocks(stripes)
+    
+    def allow(self, client_ip):
+        key_hash = stable_hash(client_ip)
+        stripe = key_hash % self.stripe_count
+        first_slot = stripe * self.slots_per_stripe
+        start = (key_hash // self.stripe_count) % self.slots_per_stripe
+        
+        if not self.locks.acquire(stripe):
+            return True
+        try:
+            now = time.monotonic()
+            offset, state, reusable_offset = None, None, None
+            
+            for probe in range(self.slots_per_stripe):
+                slot_offset = (first_slot + (start + probe) % self.slots_per_stripe) * self.SLOT.size
+                slot_hash, *slot_state = self.SLOT.unpack_from(self.memory, slot_offset)
+                if slot_hash == key_hash:
+                    offset, state = slot_offset, slot_state[:self.limiter.state_size]
+                    break
+                if slot_hash == 0:
+                    offset = reusable_offset if reusable_offset is not None else slot_offset
+                    break
+                if reusable_offset is None and now - self.limiter.last_seen(slot_state) > self.limiter.idle_timeout:
+                    reusable_offset = slot_offset
+            
+            if offset is None:
+                offset = reusable_offset
+                if offset is None:
+                    return True
+            
+            clients = {} if state is None else {client_ip: state}
+            allowed = self.limiter.check(clients, client_ip, now)
+            state = clients[client_ip] + [0.0] * (3 - self.limiter.state_size)
+            self.SLOT.pack_into(self.memory, offset, key_hash, *state)
+            return allowed
+        finally:
+            self.locks.release(stripe)
+
+class StripedRateLimiter:
+    # Per-IP state is spread over independently locked stripes chosen by a
+    # hash of the IP, so clients only contend with the few others sharing
+    # their stripe. Each request does a constant amount of work, and a
+    # background sweeper drops clients that have been idle for a while so
+    # the table does not grow without bound during a scan from many hosts.
+    # Subclasses provide check(clients, client_ip, now) and last_seen(state).
+    def __init__(self, limit=10, window=1.0, stripes=64, idle_timeout=60, sweep_interval=10):
+        self.limit = limit
+        self.window = window
+        self.idle_timeout = idle_timeout
+        self.stripes = [(threading.Lock(), {}) for _ in range(stripes)]
+        
+        # No sweeper when the state lives elsewhere (SharedRateLimiter)
+        if sweep_interval:
+            sweeper = threading.Thread(target=self.sweep_forever, args=(sweep_interval,), daemon=True)
+            sweeper.start()
+    
+    def allow(self, client_ip):
+        lock, clients = self.stripes[hash(client_ip) % len(self.stripes)]
+        with lock:
+            return self.check(clients, client_ip, time.monotonic())
+    
+    def sweep(self):
+        now = time.monotonic()
+        removed = 0
+        for lock, clients in self.stripes:
+            with lock:
+                idle = [ip for ip, state in clients.items() if now - self.last_seen(state) > self.idle_timeout]
+                for ip in idle:
+                    del clients[ip]
+            removed += len(idle)
+        return removed
+    
+    def sweep_forever(self, sweep_interval):
+        while True:
+            time.sleep(sweep_interval)
+            self.sweep()
+    
+    def tracked_clients(self):
+        return sum(len(clients) for _, clients in self.stripes)
+
+class TokenBucketLimiter(StripedRateLimiter):
+    # Tokens refill at limit/window per second up to `burst`; each request
+    # spends one. State per client: [tokens, last_refill]
+    state_size = 2
+    
+    def __init__(self, limit=10, window=1.0, burst=None, **kwargs):
+        super().__init__(limit, window, **kwargs)
+        self.burst = burst or limit
+        self.refill_rate = limit / window
+    
+    def check(self, clients, client_ip, now):
+        state = clients.get(client_ip)
+        if state is None:
+            state = clients[client_ip] = [self.burst, now]
+        
+        tokens = min(self.burst, state[0] + (now - state[1]) * self.refill_rate)
+        state[1] = now
+        if tokens >= 1:
+            state[0] = tokens - 1
+            return True
+        state[0] = tokens
+        return False
+    
+    def last_seen(self, state):
+        return state[1]
+
+class SlidingWindowLimiter(StripedRateLimiter):
+    # Sliding-window counter: the previous fixed window's count is weighted
+    # by how much of it still overlaps the sliding window. State per
+    # client: [window_start, current_count, previous_count]
+    state_size = 3
+    
+    def __init__(self, limit=10, window=1.0, burst=None, **kwargs):
+        # A window counter has no separate burst allowance
+        super().__init__(limit, window, **kwargs)
+    
+    def check(self, clients, client_ip, now):
+        window_start = now - (now % self.window)
+        state = clients.get(client_ip)
+        if state is None:
+            state = clients[client_ip] = [window_start, 0, 0]
+        
+        if state[0] != window_start:
+            # One window later the current count becomes the previous one;
+            # any longer gap means both are empty
+            elapsed_windows = round((window_start - state[0]) / self.window)
+            state[2] = state[1] if elapsed_windows == 1 else 0
+            state[1] = 0
+            state[0] = window_start
+        
+        overlap = 1.0 - (now - window_start) / self.window
+        if state[2] * overlap + state[1] < self.limit:
+            state[1] += 1
+            return True
+        return False
+    
+    def last_seen(self, state):
+        return state[0] + self.window
+
+RATE_LIMITERS = {
+    'token-bucket': TokenBucketLimiter,
+    'sliding-window': SlidingWindowLimiter,
+}
+
+class BandwidthLimiter:
+    # Egress shaping for response bodies. Each client IP may send
+    # client_rate bytes/second with `burst` bytes of slack (GCRA, the
+    # scheduling form of a token bucket). With global_rate, the clients
+    # downloading at the moment split that rate evenly, so one client
+    # mirroring a directory can't take the whole uplink. reserve() books
+    # bytes about to be sent and returns how long to wait first. Limits
+    # are per process: with --workers each worker shapes its own clients.
+    def __init__(self, client_rate=None, global_rate=None, burst=256 * 1024, max_idle_clients=4096):
+        self.client_rate = client_rate
+        self.global_rate = global_rate
+        self.burst = burst
+        self.max_idle_clients = max_idle_clients
+        self.lock = threading.Lock()
+        # client_ip -> [theoretical arrival time, transfers in progress]
+        self.clients = {}
+        self.active_clients = 0
+    
+    def start(self, client_ip):
+        with self.lock:
+            state = self.state(client_ip)
+            if state[1] == 0:
+                self.active_clients += 1
+            state[1] += 1
+    
+    def finish(self, client_ip):
+        with self.lock:
+            state = self.clients[client_ip]
+            state[1] -= 1
+            if state[1] == 0:
+                self.active_clients -= 1
+    
+    def reserve(self, client_ip, count):
+        now = time.monotonic()
+        with self.lock:
+            state = self.state(client_ip)
+            rate = self.rate()
+            state[0] = max(state[0], now) + count / rate
+            return max(0.0, state[0] - self.burst / rate - now)
+    
+    def throttled(self, client_ip):
+        # Whether the client has used up its burst and would have to wait
+        with self.lock:
+            state = self.clients.get(client_ip)
+            return state is not None and state[0] - self.burst / self.rate() > time.monotonic()
+    
+    def rate(self):
+        # Caller must hold self.lock
+        rate = self.client_rate
+        if self.global_rate:
+            share = self.global_rate / max(1, self.active_clients)
+            rate = share if rate is None else min(rate, share)
+        return rate
+    
+    def state(self, client_ip):
+        # Caller must hold self.lock. Clients with a full budget and no
+        # transfer need no state, so they are dropped when the table grows
+        state = self.clients.get(client_ip)
+        if state is None:
+            if len(self.clients) - self.active_clients >= self.max_idle_clients:
+                now = time.monotonic()
+                for ip in [ip for ip, (tat, transfers) in self.clients.items() if not transfers and tat <= now]:
+                    del self.clients[ip]
+            state = self.clients[client_ip] = [0.0, 0]
+        return state
+    
+    def shaped_clients(self):
+        return self.active_clients
+
+class RequestScheduler:
+    # The queue behind BoundedThreadPool. Tasks are queued per class, and a
+    # free worker takes the backlogged class that has had the least service
+    # for its weight (weighted fair queuing by task count), so a burst in
+    # one class cannot starve the others. A class may also be capped to a
+    # number of running tasks, which keeps bulk downloads from taking every
+    # worker. max_queue_size bounds each class's queue on its own, so a
+    # backlog of capped bulk work can't fill the queue for the other
+    # classes; put_nowait() raises queue.Full and get() queue.Empty like
+    # queue.Queue.
+    def __init__(self, classes, max_queue_size=100):
+        # classes: {name: (weight, max running tasks or None)}
+        self.weights = {name: weight for name, (weight, _) in classes.items()}
+        self.limits = {name: limit for name, (_, limit) in classes.items()}
+        self.queues = {name: deque() for name in classes}
+        self.running = dict.fromkeys(classes, 0)
+        # Virtual time per class; a class that goes idle and comes back
+        # starts from the current virtual time instead of its old credit
+        self.virtual = dict.fromkeys(classes, 0.0)
+        self.virtual_now = 0.0
+        self.max_queue_size = max_queue_size
+        self.size = 0
+        self.available = threading.Condition(threading.Lock())
+    
+    def put_nowait(self, task_class, item):
+        with self.available:
+            tasks = self.queues[task_class]
+            if len(tasks) >= self.max_queue_size:
+                raise queue.Full
+            if not tasks:
+                self.virtual[task_class] = max(self.virtual[task_class], self.virtual_now)
+            tasks.append(item)
+            self.size += 1
+            self.available.notify()
+    
+    def get(self, timeout=None):
+        # Returns (task_class, item) of the next task to run
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.available:
+            while True:
+                task_class = self.next_class()
+                if task_class is not None:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self.available.wait(remaining)
+            
+            self.size -= 1
+            self.running[task_class] += 1
+            self.virtual_now = self.virtual[task_class]
+            self.virtual[task_class] += 1 / self.weights[task_class]
+            return task_class, self.queues[task_class].popleft()
+    
+    def next_class(self):
+        # Caller must hold self.available
+        best = None
+        for name, tasks in self.queues.items():
+            limit = self.limits[name]
+            if tasks and (limit is None or self.running[name] < limit):
+                if best is None or self.virtual[name] < self.virtual[best]:
+                    best = name
+        return best
+    
+    def task_done(self, task_class):
+        with self.available:
+            self.running[task_class] -= 1
+            if self.limits[task_class] is not None and self.queues[task_class]:
+                # A capped task may run now
+                self.available.notify()
+    
+    def qsize(self):
+        return self.size
+
+class BoundedThreadPool:
+    # Worker threads fed from a bounded queue. submit() never blocks: when
+    # the queue is full it raises queue.Full so the accept loop can shed
+    # load instead of piling up sockets that clients have long given up on.
+    # Threads are started on demand up to min_workers. Beyond that, up to
+    # max_workers, a thread is added whenever a task waited in the queue
+    # longer than grow_after seconds, and extra threads exit after
+    # idle_timeout seconds without work. classes are passed on to the
+    # RequestScheduler; by default there is one FIFO class.
+    def __init__(self, min_workers=10, max_workers=None, max_queue_size=100, grow_after=0.05, idle_timeout=30,
+                 classes=None):
+        self.min_workers = min_workers
+        self.max_workers = max(max_workers or min_workers, min_workers)
+        self.grow_after = grow_after
+        self.idle_timeout = idle_timeout
+        self.tasks = RequestScheduler(classes or {'default': (1, None)}, max_queue_size)
+        # Called with (task_class, seconds waited) as each task starts
+        self.wait_observer = None
+        self.lock = threading.Lock()
+        self.workers = 0
+        self.idle_workers = 0
+        self.running = True
+    
+    def submit(self, fn, *args, task_class='default'):
+        self.tasks.put_nowait(task_class, (time.monotonic(), fn, args))
+        with self.lock:
+            if self.idle_workers == 0 and self.workers < self.min_workers:
+                self.start_worker()
+    
+    def start_worker(self):
+        # Caller must hold self.lock
+        self.workers += 1
+        threading.Thread(target=self.worker_loop, daemon=True).start()
+    
+    def worker_loop(self):
+        while self.running:
+            with self.lock:
+                self.idle_workers += 1
+            try:
+                task_class, (enqueued_at, fn, args) = self.tasks.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self.lock:
+                    self.idle_workers -= 1
+                    if self.workers > self.min_workers:
+                        self.workers -= 1
+                        return
+                continue
+            
+            waited = time.monotonic() - enqueued_at
+            with self.lock:
+                self.idle_workers -= 1
+                # Work is waiting too long: add a thread if allowed
+                if waited > self.grow_after and self.workers < self.max_workers:
+                    self.start_worker()
+            if self.wait_observer is not None:
+                self.wait_observer(task_class, waited)
+            
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Error in worker thread: {e}")
+            finally:
+                self.tasks.task_done(task_class)
+        
+        with self.lock:
+            self.workers -= 1
+    
+    def queue_depth(self):
+        return self.tasks.qsize()
+    
+    def shutdown(self):
+        # Workers are daemon threads; stop them taking new work
+        self.running = False
+
+class ServerMetrics:
+    # Counters behind the /__metrics endpoint, rendered in the Prometheus
+    # text format. Everything is a plain count in a ShardedCounter (or a
+    # SharedCounterTable in pre-fork mode, so totals cover every worker):
+    # recording a request is one increment_many() on the thread's own
+    # shard, and merging only happens when the endpoint is scraped.
+    # Histogram buckets are stored non-cumulative and sums in microseconds
+    # so the shared table's integer slots can hold them. Keys are
+    # tab-separated with the route last, since it is the only free-form part.
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    PHASES = ('parse', 'fs_lookup', 'send')
+    
+    def __init__(self, counters=None, max_routes=64):
+        self.counters = counters or ShardedCounter()
+        # Route labels are top-level path segments; past max_routes distinct
+        # ones, and for error responses, requests are filed under "other" so
+        # random URLs cannot blow up the number of series
+        self.max_routes = max_routes
+        self.routes = set()
+        self.routes_lock = threading.Lock()
+    
+    def route_label(self, path, status_code):
+        if status_code >= 400 and status_code != 416:
+            return 'other'
+        route = '/' + path.lstrip('/').split('/', 1)[0][:100]
+        if route in self.routes:
+            return route
+        with self.routes_lock:
+            if len(self.routes) >= self.max_routes:
+                return 'other'
+            self.routes.add(route)
+        return route
+    
+    def request_started(self):
+        self.counters.increment('in_flight')
+    
+    def request_finished(self):
+        self.counters.increment('in_flight', -1)
+    
+    def record_request(self, path, status_code, parse_seconds, lookup_seconds, send_seconds, bytes_sent):
+        route = self.route_label(path, status_code)
+        amounts = [(f'status\t{status_code}', 1), ('bytes_sent', bytes_sent)]
+        for phase, seconds in zip(self.PHASES, (parse_seconds, lookup_seconds, send_seconds)):
+            bucket = bisect.bisect_left(self.BUCKETS, seconds)
+            amounts.append((f'latency\t{phase}\t{bucket}\t{route}', 1))
+            amounts.append((f'latency_sum\t{phase}\t{route}', int(seconds * 1000000)))
+        self.counters.increment_many(amounts)
+    
+    def record_queue_wait(self, task_class, seconds):
+        bucket = bisect.bisect_left(self.BUCKETS, seconds)
+        self.counters.increment_many([(f'queue_wait\t{bucket}\t{task_class}', 1),
+                                      (f'queue_wait_sum\t{task_class}', int(seconds * 1000000))])
+    
+    def record_throttle(self, seconds):
+        self.counters.increment('throttled_us', int(seconds * 1000000))
+    
+    def record_status(self, status_code, bytes_sent=0):
+        # Responses sent outside a parsed request (malformed requests)
+        self.counters.increment_many([(f'status\t{status_code}', 1), ('bytes_sent', bytes_sent)])
+    
+    def increment(self, key, amount=1):
+        self.counters.increment(key, amount)
+    
+    def render(self, gauges, caches, counters=None):
+        # gauges and counters: {name: (help, value)} for values kept
+        # elsewhere; caches: {name: stats dict with hits and misses}
+        counts = self.counters.snapshot()
+        statuses = {}
+        deadlines = {}
+        dispatches = {}
+        histograms = {}
+        sums = {}
+        queue_waits = {}
+        queue_wait_sums = {}
+        for key, count in counts.items():
+            kind, _, rest = key.partition('\t')
+            if kind == 'status':
+                statuses[rest] = count
+            elif kind == 'deadline':
+                deadlines[rest] = count
+            elif kind == 'dispatch':
+                dispatches[rest] = count
+            elif kind == 'latency':
+                phase, bucket, route = rest.split('\t', 2)
+                histograms.setdefault((phase, route), [0] * (len(self.BUCKETS) + 1))[int(bucket)] += count
+            elif kind == 'latency_sum':
+                phase, route = rest.split('\t', 1)
+                sums[(phase, route)] = count
+            elif kind == 'queue_wait':
+                bucket, task_class = rest.split('\t', 1)
+                queue_waits.setdefault(task_class, [0] * (len(self.BUCKETS) + 1))[int(bucket)] += count
+            elif kind == 'queue_wait_sum':
+                queue_wait_sums[rest] = count
+        
+        lines = [
+            '# HELP http_requests_total Responses sent, by status code.',
+            '# TYPE http_requests_total counter',
+        ]
+        for status_code in sorted(statuses):
+            lines.append(f'http_requests_total{{code="{status_code}"}} {statuses[status_code]}')
+        
+        lines.append('# HELP http_request_phase_seconds Time per request phase, by top-level path.')
+        lines.append('# TYPE http_request_phase_seconds histogram')
+        for (phase, route), buckets in sorted(histograms.items()):
+            labels = f'phase="{phase}",route="{self.escape_label(route)}"'
+            total = 0
+            for bound, count in zip(self.BUCKETS + ('+Inf',), buckets):
+                total += count
+                lines.append(f'http_request_phase_seconds_bucket{{{labels},le="{bound}"}} {total}')
+            lines.append(f'http_request_phase_seconds_sum{{{labels}}} {sums.get((phase, route), 0) / 1000000:.6f}')
+            lines.append(f'http_request_phase_seconds_count{{{labels}}} {total}')
+        
+        lines.append('# HELP http_queue_wait_seconds Time spent queued for a worker, by scheduling class.')
+        lines.append('# TYPE http_queue_wait_seconds histogram')
+        for task_class, buckets in sorted(queue_waits.items()):
+            labels = f'class="{self.escape_label(task_class)}"'
+            total = 0
+            for bound, count in zip(self.BUCKETS + ('+Inf',), buckets):
+                total += count
+                lines.append(f'http_queue_wait_seconds_bucket{{{labels},le="{bound}"}} {total}')
+            lines.append(f'http_queue_wait_seconds_sum{{{labels}}} {queue_wait_sums.get(task_class, 0) / 1000000:.6f}')
+            lines.append(f'http_queue_wait_seconds_count{{{labels}}} {total}')
+        
+        for name, help_text in (('bytes_sent', 'Response bytes written, headers included.'),
+                                ('rate_limited', 'Requests rejected by the rate limiter.'),
+                                ('overloaded', 'Connections rejected with 503 because the worker queue was full.')):
+            lines.append(f'# HELP http_{name}_total {help_text}')
+            lines.append(f'# TYPE http_{name}_total counter')
+            lines.append(f'http_{name}_total {counts.get(name, 0)}')
+        lines.append('# HELP http_throttled_seconds_total Time responses were held back by bandwidth shaping.')
+        lines.append('# TYPE http_throttled_seconds_total counter')
+        lines.append(f'http_throttled_seconds_total {counts.get("throttled_us", 0) / 1000000:.6f}')
+        lines.append('# HELP http_deadline_exceeded_total Connections closed for missing a deadline.')
+        lines.append('# TYPE http_deadline_exceeded_total counter')
+        for kind in ConnectionDeadlines.KINDS:
+            lines.append(f'http_deadline_exceeded_total{{deadline="{kind}"}} {deadlines.get(kind, 0)}')
+        if dispatches:
+            lines.append('# HELP http_requests_dispatched_total Requests answered in the accept loop or by the pool.')
+            lines.append('# TYPE http_requests_dispatched_total counter')
+            for target in sorted(dispatches):
+                lines.append(f'http_requests_dispatched_total{{to="{target}"}} {dispatches[target]}')
+        for name, (help_text, value) in (counters or {}).items():
+            lines.append(f'# HELP http_{name}_total {help_text}')
+            lines.append(f'# TYPE http_{name}_total counter')
+            lines.append(f'http_{name}_total {value}')
+        
+        gauges = dict(gauges, requests_in_flight=('Requests being served right now.', counts.get('in_flight', 0)))
+        for name, (help_text, value) in gauges.items():
+            lines.append(f'# HELP http_{name} {help_text}')
+            lines.append(f'# TYPE http_{name} gauge')
+            lines.append(f'http_{name} {value}')
+        
+        for metric, help_text in (('hits', 'Cache lookups that were served from the cache.'),
+                                  ('misses', 'Cache lookups that missed.')):
+            lines.append(f'# HELP http_cache_{metric}_total {help_text}')
+            lines.append(f'# TYPE http_cache_{metric}_total counter')
+            for cache, stats in caches.items():
+                lines.append(f'http_cache_{metric}_total{{cache="{cache}"}} {stats[metric]}')
+        lines.append('# HELP http_cache_hit_ratio Hits over lookups since start.')
+        lines.append('# TYPE http_cache_hit_ratio gauge')
+        for cache, stats in caches.items():
+            lookups = stats['hits'] + stats['misses']
+            lines.append(f'http_cache_hit_ratio{{cache="{cache}"}} {stats["hits"] / lookups if lookups else 0:.4f}')
+        
+        return '\n'.join(lines) + '\n'
+    
+    def escape_label(self, value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class AccessLog:
+    # Access log kept off the request path: handlers append a small record
+    # tuple to a deque (append and popleft are atomic, so no lock is taken)
+    # and a background thread formats records and writes them in batches.
+    # When max_records are already waiting, new records are dropped and
+    # counted instead of slowing requests down. The file is rotated like
+    # logging's RotatingFileHandler once it grows past max_bytes.
+    # path '-' writes to stdout.
+    FORMATS = ('common', 'combined', 'json')
+    
+    def __init__(self, path, log_format='combined', max_bytes=10 * 1024 * 1024, backup_count=5,
+                 max_records=10000, flush_interval=0.5):
+        if log_format not in self.FORMATS:
+            raise ValueError(f"Unknown access log format: {log_format}")
+        self.path = path
+        self.log_format = log_format
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_records = max_records
+        self.flush_interval = flush_interval
+        
+        self.records = deque()
+        self.dropped = 0
+        self.drop_lock = threading.Lock()
+        self.file = sys.stdout if path == '-' else open(path, 'a', encoding='utf-8')
+        
+        # strftime once per second, not once per record
+        self.last_second = None
+        self.last_timestamp = ''
+        
+        self.stopping = threading.Event()
+        self.writer = threading.Thread(target=self.write_forever, daemon=True)
+        self.writer.start()
+    
+    def log(self, client_ip, request, status_code, bytes_sent, duration):
+        # request is None for requests that could not be parsed
+        if len(self.records) >= self.max_records:
+            with self.drop_lock:
+                self.dropped += 1
+            return
+        self.records.append((time.time(), client_ip, request, status_code, bytes_sent, duration))
+    
+    def write_forever(self):
+        while not self.stopping.wait(self.flush_interval):
+            self.write_batch()
+        self.write_batch()
+    
+    def write_batch(self):
+        lines = []
+        try:
+            while True:
+                lines.append(self.format_record(*self.records.popleft()))
+        except IndexError:
+            pass
+        if not lines:
+            return
+        
+        try:
+            self.file.write('\n'.join(lines) + '\n')
+            self.file.flush()
+            if self.file is not sys.stdout and self.file.tell() >= self.max_bytes:
+                self.rotate()
+        except OSError as e:
+            print(f"Error writing access log: {e}")
+    
+    def rotate(self):
+        self.file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+    
+    def format_record(self, timestamp, client_ip, request, status_code, bytes_sent, duration):
+        if request is None:
+            request_line, referer, user_agent = '-', '-', '-'
+        else:
+            request_line = f"{request.method} {request.target} {request.version}"
+            referer = request.headers.get('referer', '-')
+            user_agent = request.headers.get('user-agent', '-')
+        
+        if self.log_format == 'json':
+            return json.dumps({
+                'time': timestamp,
+                'client': client_ip,
+                'request': request_line,
+                'status': status_code,
+                'bytes': bytes_sent,
+                'referer': referer,
+                'user_agent': user_agent,
+                'duration_ms': round(duration * 1000, 3),
+            })
+        
+        line = (f'{client_ip} - - [{self.format_time(timestamp)}] "{self.escape(request_line)}" '
+                f'{status_code} {bytes_sent or "-"}')
+        if self.log_format == 'combined':
+            line += f' "{self.escape(referer)}" "{self.escape(user_agent)}"'
+        return line
+    
+    def format_time(self, timestamp):
+        second = int(timestamp)
+        if second != self.last_second:
+            self.last_second = second
+            self.last_timestamp = time.strftime('%d/%b/%Y:%H:%M:%S %z', time.localtime(second))
+        return self.last_timestamp
+    
+    def escape(self, value):
+        return value.replace('\\', '\\\\').replace('"', '\\"')
+    
+    def close(self):
+        self.stopping.set()
+        self.writer.join()
+        if self.file is not sys.stdout:
+            self.file.close()
+
+class ConnectionDeadlines:
+    # How long one connection may take, in seconds. header: a whole request
+    # head, counted from its first byte (from the accept for the first
+    # request). idle: a kept-alive connection waiting for its next request.
+    # response: writing one response. After send_grace seconds a response
+    # must also have averaged min_send_rate bytes per second (0 turns the
+    # floor off), so a client reading a large file a few bytes at a time
+    # is dropped instead of holding a worker for hours.
+    KINDS = ('header', 'idle', 'response', 'send_rate')
+    
+    def __init__(self, header=10, idle=5, response=300, min_send_rate=4096, send_grace=10):
+        self.header = header
+        self.idle = idle
+        self.response = response
+        self.min_send_rate = min_send_rate
+        self.send_grace = send_grace
+
+class SendDeadline:
+    # The deadlines of one response being written. The transfer-rate floor
+    # moves with the bytes sent: a client that has taken n bytes may
+    # stall until send_grace + n / min_send_rate seconds after the start.
+    def __init__(self, deadlines):
+        self.deadlines = deadlines
+        self.started = time.monotonic()
+        self.sent = 0
+        # The deadline that the last remaining() was limited by
+        self.kind = 'response'
+    
+    def remaining(self, count=0):
+        # Seconds left to send `count` more bytes
+        deadlines = self.deadlines
+        limit = deadlines.response
+        self.kind = 'response'
+        if deadlines.min_send_rate:
+            rate_limit = deadlines.send_grace + (self.sent + count) / deadlines.min_send_rate
+            if rate_limit < limit:
+                limit = rate_limit
+                self.kind = 'send_rate'
+        
+        remaining = self.started + limit - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(self.kind)
+        return remaining
+    
+    def arm(self, client_socket, count=0):
+        # Socket timeout for the next blocking send
+        client_socket.settimeout(self.remaining(count))
+    
+    def extend(self, seconds):
+        # Time the server held the response back doesn't count
+        self.started += seconds
+
+class ClientConnection:
+    # An accepted connection and what is kept between its requests: the
+    # parser (holding any pipelined bytes), the request count and when the
+    # pending request head started to arrive. In the multithreaded server
+    # it moves between the ConnectionPoller and pool workers.
+    def __init__(self, client_socket, client_address, parser, deadlines):
+        self.socket = client_socket
+        self.address = client_address
+        self.parser = parser
+        self.deadlines = deadlines
+        self.requests_served = 0
+        # The first request head is timed from the accept
+        self.head_started = time.monotonic()
+        self.idle_since = self.head_started
+        # Deadline while parked in the poller, None while a worker has it
+        self.parked_until = None
+        # Left for a worker by HybridHTTPServer: a resolved (request,
+        # full_path), and (unsent bytes, keep_alive) of a response
+        self.pending_request = None
+        self.pending_output = None
+    
+    def read_deadline(self):
+        # (kind, monotonic time) by which the next request head must be in
+        if self.head_started is not None:
+            return 'header', self.head_started + self.deadlines.header
+        return 'idle', self.idle_since + self.deadlines.idle
+    
+    def bytes_received(self):
+        if self.head_started is None:
+            self.head_started = time.monotonic()
+    
+    def response_finished(self):
+        self.idle_since = time.monotonic()
+        # Pipelined bytes already count as the start of the next head
+        self.head_started = self.idle_since if self.parser.buffer else None
+
+class ConnectionPoller:
+    # Keeps connections that are waiting for request bytes off the worker
+    # pool: new connections until their first request arrives, kept-alive
+    # ones between requests and slow clients between the pieces of a
+    # request head. Runs in the accept loop's thread, with one selector for
+    # the listening socket and every parked connection. A readable
+    # connection goes to dispatch(), one past its header or idle deadline
+    # to expire(). Workers hand connections back with park(), which may be
+    # called from any thread: it queues the connection and wakes the
+    # selector with a byte on a socketpair.
+    def __init__(self, listen_socket, accept, dispatch, expire):
+        self.listen_socket = listen_socket
+        self.accept = accept
+        self.dispatch = dispatch
+        self.expire = expire
+        self.selector = selectors.DefaultSelector()
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.returned = deque()
+        # Heap of (deadline, sequence, weakref to connection). A connection
+        # that was dispatched or parked again since leaves a stale entry
+        # behind, which is skipped when it comes up. The weakref lets a
+        # closed connection be freed without waiting for its entry, and the
+        # heap is rebuilt when stale entries outnumber parked connections.
+        self.deadlines = []
+        self.sequence = 0
+        self.parked = 0
+    
+    def park(self, connection):
+        self.returned.append(connection)
+        try:
+            self.wake_writer.send(b'\0')
+        except BlockingIOError:
+            # Plenty of wake-ups are pending already
+            pass
+    
+    def run(self):
+        self.listen_socket.setblocking(False)
+        self.selector.register(self.listen_socket, selectors.EVENT_READ)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+        try:
+            while True:
+                timeout = None
+                if self.deadlines:
+                    timeout = max(0, self.deadlines[0][0] - time.monotonic())
+                
+                for key, _ in self.selector.select(timeout):
+                    if key.fileobj is self.listen_socket:
+                        self.accept_pending()
+                    elif key.fileobj is self.wake_reader:
+                        self.watch_returned()
+                    else:
+                        self.unwatch(key.data)
+                        self.dispatch(key.data)
+                
+                self.expire_overdue()
+        finally:
+            self.close()
+    
+    def accept_pending(self):
+        while True:
+            try:
+                client_socket, client_address = self.listen_socket.accept()
+            except BlockingIOError:
+                return
+            self.watch(self.accept(client_socket, client_address))
+    
+    def watch_returned(self):
+        try:
+            while self.wake_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.returned:
+            self.watch(self.returned.popleft())
+    
+    def watch(self, connection):
+        _, deadline = connection.read_deadline()
+        connection.parked_until = deadline
+        self.selector.register(connection.socket, selectors.EVENT_READ, connection)
+        self.sequence += 1
+        heapq.heappush(self.deadlines, (deadline, self.sequence, weakref.ref(connection)))
+        self.parked += 1
+        if len(self.deadlines) > 2 * self.parked + 1024:
+            self.drop_stale_deadlines()
+    
+    def drop_stale_deadlines(self):
+        live = []
+        for entry in self.deadlines:
+            connection = entry[2]()
+            if connection is not None and connection.parked_until == entry[0]:
+                live.append(entry)
+        heapq.heapify(live)
+        self.deadlines = live
+    
+    def unwatch(self, connection):
+        self.selector.unregister(connection.socket)
+        connection.parked_until = None
+        self.parked -= 1
+    
+    def expire_overdue(self):
+        now = time.monotonic()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, _, connection_ref = heapq.heappop(self.deadlines)
+            connection = connection_ref()
+            if connection is None or connection.parked_until != deadline:
+                continue
+            self.unwatch(connection)
+            self.expire(connection, connection.read_deadline()[0])
+    
+    def close(self):
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None:
+                key.data.socket.close()
+        self.selector.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
 
 class HTTPServer:
-    def __init__(self, host='0.0.0.0', port=8080):
+    def __init__(self, host='0.0.0.0', port=8080, rate_limit=10, rate_limit_window=1.0,
+                 rate_limit_burst=None, rate_limit_algorithm='sliding-window',
+                 request_counters=None, rate_limiter=None, metrics_counters=None, reuse_port=False,
+                 pool_size=10, max_pool_size=None, max_queue_size=100, listen_backlog=128,
+                 access_log=None, access_log_format='combined', access_log_max_bytes=10 * 1024 * 1024,
+                 console_log=True, index_poll_interval=1.0, header_timeout=10, idle_timeout=5,
+                 response_timeout=300, min_send_rate=4096, bulk_workers=None, client_bandwidth=None,
+                 total_bandwidth=None, bandwidth_burst=256 * 1024):
         self.host = host
         self.port = port
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # Pre-fork workers each bind their own socket to the same port
+            # and the kernel spreads new connections across them
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         
-        # For request counting - thread-safe implementation
-        self.request_counters = {}
-        self.counter_lock = threading.Lock()
+        # For request counting - thread-safe implementation. Pre-fork
+        # workers pass a SharedCounterTable instead
+        self.request_counters = request_counters or ShardedCounter()
         
         # For rate limiting
-        self.client_requests = {}
-        self.rate_limit_lock = threading.Lock()
-        self.rate_limit = 10
+        self.rate_limiter = rate_limiter or RATE_LIMITERS[rate_limit_algorithm](
+            limit=rate_limit, window=rate_limit_window, burst=rate_limit_burst
+        )
         
-        self.thread_pool = ThreadPoolExecutor(max_workers=10)
+        # Egress shaping in bytes/second, off unless a rate is given
+        self.bandwidth_limiter = None
+        if client_bandwidth or total_bandwidth:
+            self.bandwidth_limiter = BandwidthLimiter(client_bandwidth, total_bandwidth, bandwidth_burst)
+        
+        # Simulated work per request, in seconds
+        self.simulated_delay = 1
+        
+        # Small file bodies, shared by every worker
+        self.content_cache = ContentCache()
+        
+        # Metadata of the served tree, built when serving starts
+        self.file_index = None
+        self.index_poll_interval = index_poll_interval
+        
+        # Directory listings: cached entries and pagination limits
+        self.listing_cache = DirectoryListingCache()
+        self.listing_page_size = 1000
+        self.max_listing_page_size = 5000
+        
+        # Cache-Control max-age per MIME type, in seconds
+        self.cache_max_age = {
+            'text/html': 60,
+            'text/plain': 60,
+            'image/png': 86400,
+            'application/pdf': 3600,
+        }
+        
+        # Per-connection deadlines; idle is also the keep-alive timeout
+        self.deadlines = ConnectionDeadlines(header_timeout, idle_timeout, response_timeout, min_send_rate)
+        
+        # HTTP/1.1 persistent connections
+        self.max_keepalive_requests = 100
+        
+        # Request parser limits (414 / 431 beyond these)
+        self.max_request_line = 8190
+        self.max_header_size = 16384
+        
+        # Cached header bytes and status pages, and the vectored send
+        self.response_writer = ResponseWriter()
+        
+        # Worker pool with a bounded queue; a full queue gets a fast 503.
+        # Requests are queued by expected response size: files above
+        # bulk_response_bytes may use at most bulk_workers threads (half
+        # the pool by default), so small files and listings never wait for
+        # every worker to finish a large download
+        self.bulk_response_bytes = 1024 * 1024
+        bulk_workers = bulk_workers or max(1, (max_pool_size or pool_size) // 2)
+        self.thread_pool = BoundedThreadPool(pool_size, max_pool_size, max_queue_size, classes={
+            'small': (4, None),
+            'listing': (2, None),
+            'bulk': (1, bulk_workers),
+        })
+        self.listen_backlog = listen_backlog
+        self.retry_after = 1
+        overload_response = self.error_response(503, "Service Unavailable",
+                                                headers=[('Retry-After', str(self.retry_after))])
+        self.overload_response_bytes = overload_response.header_bytes() + overload_response.body
+        timeout_response = self.error_response(408, "Request Timeout")
+        self.timeout_response_bytes = timeout_response.header_bytes() + timeout_response.body
+        
+        # Watches connections between requests; created by serve_directory
+        self.connection_poller = None
+        # Whether a worker gives the connection back to the poller after
+        # each request instead of reading the next one itself
+        self.return_to_poller = False
+        
+        # Served at METRICS_PATH; pre-fork workers share metrics_counters
+        self.metrics = ServerMetrics(metrics_counters)
+        self.thread_pool.wait_observer = self.metrics.record_queue_wait
+        
+        # Access log file written by a background thread, and whether to
+        # also print a line per connection and request to the console
+        self.access_log = None
+        if access_log:
+            self.access_log = AccessLog(access_log, access_log_format, access_log_max_bytes)
+        self.console_log = console_log
     
-    def serve_directory(self, base_directory):
+    def open_base_directory(self, base_directory):
         self.base_directory = Path(base_directory).resolve()
         print(f"Serving directory: {self.base_directory}")
         
+        self.file_index = FileIndex(self.base_directory, self.guess_content_type, self.index_poll_interval)
+        self.file_index.start()
+        self.listing_cache.file_index = self.file_index
+    
+    def serve_directory(self, base_directory):
+        self.open_base_directory(base_directory)
+        
         try:
             self.socket.bind((self.host, self.port))
-            self.socket.listen(5)
+            self.socket.listen(self.listen_backlog)
             print(f"Server running on http://{self.host}:{self.port}")
             
-            while True:
-                client_socket, client_address = self.socket.accept()
-                print(f"Connection from {client_address}")
-                
-                self.thread_pool.submit(self.handle_client_thread, client_socket, client_address)
+            # Connections only take a worker once they have bytes to read
+            self.connection_poller = ConnectionPoller(self.socket, self.accept_connection,
+                                                      self.dispatch_connection, self.expire_connection)
+            self.connection_poller.run()
                 
         except KeyboardInterrupt:
             print("\nShutting down server...")
-            self.thread_pool.shutdown(wait=False)
+            self.thread_pool.shutdown()
         finally:
             self.socket.close()
+            self.close_access_log()
+    
+    def close_access_log(self):
+        # Flushes records still waiting in the buffer
+        if self.access_log is not None:
+            self.access_log.close()
+    
+    def log_access(self, client_ip, request, status_code, bytes_sent, started):
+        if self.access_log is not None:
+            self.access_log.log(client_ip, request, status_code, bytes_sent, time.perf_counter() - started)
+    
+    def accept_connection(self, client_socket, client_address):
+        if self.console_log:
+            print(f"Connection from {client_address}")
+        # Responses are written in whole pieces, so Nagle would only add delay
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return ClientConnection(client_socket, client_address, self.create_parser(), self.deadlines)
+    
+    def dispatch_connection(self, connection):
+        try:
+            self.thread_pool.submit(self.handle_client_thread, connection,
+                                    task_class=self.classify_connection(connection))
+        except queue.Full:
+            if connection.pending_output is None:
+                self.reject_connection(connection.socket)
+                return
+            # Part of a response is already out, so a 503 would corrupt the
+            # stream; reset the connection instead
+            self.metrics.increment('overloaded')
+            connection.socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            connection.socket.close()
+    
+    def classify_connection(self, connection):
+        # Scheduling class of the request a worker will answer next, from
+        # its request line (peeked, so the worker still reads it) and the
+        # size the file index has for the path
+        if connection.pending_output is not None:
+            return 'small'
+        if connection.pending_request is not None:
+            return self.classify_path(connection.pending_request[1])
+        
+        try:
+            data = connection.socket.recv(self.max_request_line + 2,
+                                          socket.MSG_PEEK | getattr(socket, 'MSG_DONTWAIT', 0))
+        except OSError:
+            return 'small'
+        request_line = (bytes(connection.parser.buffer[:self.max_request_line]) + data).split(b'\r\n', 1)[0]
+        parts = request_line.split(b' ')
+        if len(parts) != 3:
+            return 'small'
+        
+        path = urllib.parse.unquote(parts[1].decode('utf-8', 'replace').partition('?')[0], errors='replace')
+        safe_path = Path(path.lstrip('/'))
+        if '..' in safe_path.parts:
+            return 'small'
+        return self.classify_path(self.base_directory / safe_path)
+    
+    def classify_path(self, full_path):
+        index_entry = self.file_index.lookup(full_path)
+        if index_entry is None:
+            return 'small'
+        if index_entry.is_dir:
+            return 'listing'
+        if index_entry.is_file and index_entry.stat.st_size > self.bulk_response_bytes:
+            return 'bulk'
+        return 'small'
     
-    def handle_client_thread(self, client_socket, client_address):
+    def expire_connection(self, connection, kind):
+        if self.record_deadline(connection, kind):
+            self.send_nonblocking(connection.socket, self.timeout_response_bytes)
+        connection.socket.close()
+    
+    def record_deadline(self, connection, kind):
+        # Counts a missed deadline. Returns True when the client should get
+        # a 408: part of a request head arrived, but not all of it in time
+        self.metrics.increment(f'deadline\t{kind}')
+        if self.console_log and kind != 'idle':
+            print(f"Closing connection from {connection.address}: {kind} deadline exceeded")
+        if kind == 'header' and connection.parser.buffer:
+            self.metrics.record_status(408, len(self.timeout_response_bytes))
+            return True
+        return False
+    
+    def reject_connection(self, client_socket):
+        # Answer straight from the accept loop with pre-encoded bytes; never
+        # block here, or one slow client would stall every accept
+        self.metrics.increment('overloaded')
+        bytes_sent = self.send_nonblocking(client_socket, self.overload_response_bytes)
+        self.metrics.record_status(503, bytes_sent)
+        client_socket.close()
+    
+    def send_nonblocking(self, client_socket, data):
+        # Best effort: whatever fits in the socket buffer. Returns the
+        # number of bytes sent
+        sent = 0
+        try:
+            client_socket.setblocking(False)
+            sent = client_socket.send(data)
+            client_socket.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        return sent
+    
+    def handle_client_thread(self, connection):
+        keep_open = False
         try:
-            self.handle_client(client_socket, client_address)
+            keep_open = self.handle_client(connection)
         finally:
-            client_socket.close()
+            if keep_open:
+                self.connection_poller.park(connection)
+            else:
+                connection.socket.close()
     
     def check_rate_limit(self, client_ip):
-        with self.rate_limit_lock:
-            now = time.time()
-            
-            # Initialize or clean up old requests for this IP
-            if client_ip not in self.client_requests:
-                self.client_requests[client_ip] = []
-            
-            # Remove requests older than 1 second
-            self.client_requests[client_ip] = [
-                timestamp for timestamp in self.client_requests[client_ip]
-                if now - timestamp < 1.0
-            ]
-            
-            # Check if under limit
-            if len(self.client_requests[client_ip]) < self.rate_limit:
-                self.client_requests[client_ip].append(now)
-                return True
-            else:
-                return False
+        return self.rate_limiter.allow(client_ip)
     
-    def handle_client(self, client_socket, client_address):
+    def handle_client(self, connection):
+        # Serve requests from the connection until the client closes it, asks
+        # for Connection: close, misses a deadline or uses up its request
+        # budget. Pipelined requests stay in the parser buffer and are
+        # answered in order. Returns True when the connection is waiting for
+        # more bytes and goes back to the poller; without a poller
+        # (single-threaded server) reads block until the deadline instead.
+        client_socket = connection.socket
+        client_address = connection.address
+        
         try:
-            request_data = client_socket.recv(1024).decode('utf-8')
-            if not request_data:
-                return
-            
-            lines = request_data.split('\r\n')
-            if not lines:
-                return
+            if connection.pending_output is not None:
+                output, keep_alive = connection.pending_output
+                connection.pending_output = None
+                self.response_writer.send_buffers(client_socket, [output], SendDeadline(self.deadlines))
+                if not keep_alive:
+                    return False
+                if self.return_to_poller and not connection.parser.buffer:
+                    return True
             
-            request_line = lines[0]
-            parts = request_line.split()
-            if len(parts) < 2:
-                return
+            while True:
+                full_path = None
+                if connection.pending_request is not None:
+                    request, full_path = connection.pending_request
+                    connection.pending_request = None
+                else:
+                    request = self.read_request(connection)
+                    if request is None:
+                        return False
+                
+                if not self.serve_request(connection, request, full_path):
+                    return False
+                # Pipelined bytes already read won't wake the poller, so
+                # they are answered (or read up to a full head) here
+                if self.return_to_poller and not connection.parser.buffer:
+                    return True
+                
+        except BlockingIOError:
+            # No complete request yet
+            return True
+        except DeadlineExceeded as e:
+            if self.record_deadline(connection, e.kind):
+                self.send_nonblocking(client_socket, self.timeout_response_bytes)
+            elif e.kind in ('response', 'send_rate'):
+                # Reset instead of closing, or the kernel would keep feeding
+                # the slow client the megabytes already in its send buffer
+                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        except HTTPParseError as e:
+            bytes_sent = self.send_response(client_socket, e.status_code, str(e))
+            self.log_access(client_address[0], None, e.status_code, bytes_sent, time.perf_counter())
+        except ConnectionError:
+            # Client went away, or a body could not be sent in full
+            pass
+        except Exception as e:
+            print(f"Error handling client: {e}")
+            self.send_response(client_socket, 404, "Not Found")
+        return False
+    
+    def serve_request(self, connection, request, full_path=None, memory_only=False):
+        # Answers one request and returns whether to keep the connection.
+        # full_path is given when resolve_request already ran for it. With
+        # memory_only (HybridHTTPServer's poller thread) nothing may block:
+        # a request that needs the disk is left in connection.pending_request
+        # and None is returned, and a response the socket buffer cannot take
+        # at once is left in connection.pending_output.
+        client_address = connection.address
+        requests_served = connection.requests_served + 1
+        keep_alive = self.should_keep_alive(request, requests_served)
+        
+        self.metrics.request_started()
+        received = time.perf_counter()
+        try:
+            lookup_seconds = 0.0
+            response = None
+            if full_path is None:
+                response, full_path = self.resolve_request(request.method, request.path, client_address[0])
+            if response is None:
+                if memory_only and self.bandwidth_limiter is not None and \
+                        self.bandwidth_limiter.throttled(client_address[0]):
+                    # The body has to be paced, which only a worker can do
+                    connection.pending_request = (request, full_path)
+                    return None
+                if not memory_only:
+                    # Simulate work 1 second delay
+                    time.sleep(self.simulated_delay)
+                
+                started = time.perf_counter()
+                response = self.build_response(full_path, request.path, request.headers, request.query,
+                                               memory_only)
+                lookup_seconds = time.perf_counter() - started
+                if response is None:
+                    connection.pending_request = (request, full_path)
+                    return None
             
-            method, path = parts[0], parts[1]
+            connection.requests_served = requests_served
+            started = time.perf_counter()
+            if memory_only:
+                bytes_sent = self.write_response_available(connection, response, keep_alive, requests_served)
+            else:
+                bytes_sent = self.write_response(connection.socket, response, keep_alive, requests_served,
+                                                 client_address[0])
+            self.metrics.record_request(request.path, response.status_code, request.parse_seconds,
+                                        lookup_seconds, time.perf_counter() - started, bytes_sent)
+            self.log_access(client_address[0], request, response.status_code, bytes_sent, received)
+        finally:
+            self.metrics.request_finished()
+        
+        connection.response_finished()
+        return keep_alive
+    
+    def create_parser(self):
+        return RequestParser(self.max_request_line, self.max_header_size)
+    
+    def read_request(self, connection):
+        # Returns the next request, or None once the client closes the
+        # connection. With a poller reads never wait: BlockingIOError means
+        # the connection has to wait for more bytes in the poller.
+        parser = connection.parser
+        while True:
+            started = time.perf_counter()
+            request = parser.next_request()
+            if request is not None:
+                request.parse_seconds = time.perf_counter() - started
+                return request
             
-            # Rate limiting check
-            client_ip = client_address[0]
-            if not self.check_rate_limit(client_ip):
-                self.send_response(client_socket, 429, "Too Many Requests")
+            kind, deadline = connection.read_deadline()
+            if self.connection_poller is not None:
+                # The poller enforces the deadline while the connection waits;
+                # time spent queued for a worker does not count against it
+                connection.socket.settimeout(0)
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded(kind)
+                connection.socket.settimeout(remaining)
+            try:
+                if not parser.receive(connection.socket):
+                    return None
+            except socket.timeout:
+                raise DeadlineExceeded(kind)
+            connection.bytes_received()
+    
+    def should_keep_alive(self, request, requests_served):
+        if requests_served >= self.max_keepalive_requests:
+            return False
+        
+        connection = request.headers.get('connection', '').lower()
+        if request.version == 'HTTP/1.1':
+            return 'close' not in connection
+        return 'keep-alive' in connection
+    
+    def connection_header(self, keep_alive, requests_served):
+        return self.response_writer.connection_header(keep_alive, self.deadlines.idle,
+                                                      self.max_keepalive_requests - requests_served)
+    
+    def resolve_request(self, method, path, client_ip):
+        # Returns (response, None) when the request is answered without
+        # touching the served directory, else (None, full_path)
+        if method == 'GET' and path == METRICS_PATH:
+            return self.metrics_response(), None
+        
+        # Rate limiting check
+        if not self.check_rate_limit(client_ip):
+            if self.console_log:
                 print(f"Rate limit exceeded for {client_ip}")
-                return
-            
-            if method != 'GET':
-                self.send_response(client_socket, 404, "Not Found")
-                return
-            
-            # Security: prevent directory traversal
-            safe_path = Path(path.lstrip('/'))
-            if '..' in safe_path.parts:
-                self.send_response(client_socket, 404, "Not Found")
-                return
-            
-            full_path = self.base_directory / safe_path
-            
-            # Simulate work 1 second delay
-            time.sleep(1)
-            # time.sleep(0.01)
-            
+            self.metrics.increment('rate_limited')
+            return self.error_response(429, "Too Many Requests"), None
+        
+        if method != 'GET':
+            return self.error_response(404, "Not Found"), None
+        
+        # Security: prevent directory traversal
+        safe_path = Path(path.lstrip('/'))
+        if '..' in safe_path.parts:
+            return self.error_response(404, "Not Found"), None
+        
+        return None, self.base_directory / safe_path
+    
+    def build_response(self, full_path, url_path, headers=None, query='', memory_only=False):
+        # With memory_only, returns None instead of reading from the disk
+        index_entry = self.file_index.lookup(full_path)
+        if index_entry is None:
+            response = self.error_response(404, "Not Found")
+        elif index_entry.is_dir:
+            response = self.directory_listing_response(full_path, url_path, query, memory_only)
+            if response is not None:
+                response = self.compress_response(response, headers)
+        elif index_entry.is_file:
+            response = self.file_response(full_path, headers, index_entry, memory_only)
+        else:
+            response = self.error_response(404, "Not Found")
+        
+        # Only paths that exist are counted, so a scan for missing URLs
+        # can't fill the counter table
+        if response is not None and response.status_code < 400:
             # ----- RACE CONDITION SIMULATION ------
             self.update_request_counter(str(full_path))
             # self.race_condition_counter(str(full_path))
-            
-            if full_path.is_dir():
-                self.serve_directory_listing(client_socket, full_path, path)
-            elif full_path.is_file():
-                self.serve_file(client_socket, full_path)
-            else:
-                self.send_response(client_socket, 404, "Not Found")
-                
-        except Exception as e:
-            print(f"Error handling client: {e}")
-            self.send_response(client_socket, 404, "Not Found")
+        return response
     
     def update_request_counter(self, file_path):
-        with self.counter_lock:
-            if file_path in self.request_counters:
-                self.request_counters[file_path] += 1
-            else:
-                self.request_counters[file_path] = 1
-            print(f"Updated {file_path} to {self.request_counters[file_path]}")
+        self.request_counters.increment(file_path)
+        # Printed outside any lock so workers never wait on stdout
+        if self.console_log:
+            print(f"Updated {file_path} to {self.request_counters.get(file_path)}")
 
     
     def race_condition_counter(self, file_path):
-        if file_path in self.request_counters:
-            import time
+        # Deliberately unsynchronized read-modify-write, kept to demonstrate
+        # the lost-update race
+        count = self.request_counters.get(file_path)
+        if count:
             time.sleep(0.1)
-            self.request_counters[file_path] += 1
+            self.request_counters.set(file_path, count + 1)
         else:
-            self.request_counters[file_path] = 1
-        print(f"Updated {file_path} to {self.request_counters[file_path]}")
+            self.request_counters.set(file_path, 1)
+        print(f"Updated {file_path} to {self.request_counters.get(file_path)}")
 
     
     def get_request_count(self, file_path):
-        with self.counter_lock:
-            return self.request_counters.get(file_path, 0)
+        return self.request_counters.get(file_path)
+    
+    def get_request_counts(self, file_paths):
+        # One consistent read of the counters for a whole listing page
+        return self.request_counters.get_many(file_paths)
+    
+    def snapshot_request_counts(self):
+        return self.request_counters.snapshot()
+    
+    def serve_directory_listing(self, client_socket, directory_path, url_path, query=''):
+        self.write_response(client_socket, self.directory_listing_response(directory_path, url_path, query))
     
-    def serve_directory_listing(self, client_socket, directory_path, url_path):
+    def directory_listing_response(self, directory_path, url_path, query='', memory_only=False):
         try:
-            # Generate HTML directory listing with request counts
-            items = []
+            # Links are built from the path relative to the served root, so
+            # every URL spelling of a directory shares one cache entry
+            relative_path = directory_path.relative_to(self.base_directory).as_posix()
+            url_base = '/' if relative_path == '.' else f'/{relative_path}/'
+            entries = self.listing_cache.get_entries(directory_path, url_base, cached_only=memory_only)
+            if entries is None:
+                return None
+            
+            page, limit = self.listing_page(query)
+            page_count = max(1, (len(entries) + limit - 1) // limit)
+            page = min(page, page_count)
+            page_entries = entries[(page - 1) * limit:page * limit]
+            
+            count_paths = [full_path for _, full_path in page_entries]
+            
+            parent_path = None
             if url_path != '/':
                 parent_path = str(Path(url_path).parent)
                 if parent_path == '.':
                     parent_path = '/'
-                parent_full_path = str(self.base_directory / parent_path.lstrip('/'))
-                parent_count = self.get_request_count(parent_full_path)
-                items.append(f'<li><a href="{parent_path}">../</a> (Requests: {parent_count})</li>')
-            
-            for item in sorted(directory_path.iterdir()):
-                item_full_path = str(item)
-                count = self.get_request_count(item_full_path)
-                if item.is_dir():
-                    items.append(f'<li><a href="{os.path.join(url_path, item.name)}/">{item.name}/</a> (Requests: {count})</li>')
-                else:
-                    items.append(f'<li><a href="{os.path.join(url_path, item.name)}">{item.name}</a> (Requests: {count})</li>')
+                count_paths.append(str(self.base_directory / parent_path.lstrip('/')))
+            
+            # Generate HTML directory listing with request counts
+            counts = self.get_request_counts(count_paths)
+            items = []
+            if parent_path is not None:
+                items.append(f'<li><a href="{parent_path}">../</a> (Requests: {counts[-1]})</li>')
+            
+            for (link, _), count in zip(page_entries, counts):
+                items.append(f'{link} (Requests: {count})</li>')
+            
+            navigation = ''
+            if page_count > 1:
+                navigation = self.listing_navigation(page, page_count, limit)
             
             html_content = f"""
             <!DOCTYPE html>
@@ -190,114 +2393,946 @@ class HTTPServer:
                 <ul>
                 {''.join(items)}
                 </ul>
+                {navigation}
             </body>
             </html>
             """
             
-            response = f"HTTP/1.1 200 OK\r\n"
-            response += "Content-Type: text/html; charset=utf-8\r\n"
-            response += f"Content-Length: {len(html_content.encode('utf-8'))}\r\n"
-            response += "Connection: close\r\n\r\n"
-            response += html_content
-            
-            client_socket.send(response.encode('utf-8'))
+            return Response(200, body=html_content.encode('utf-8'))
             
         except Exception as e:
             print(f"Error generating directory listing: {e}")
-            self.send_response(client_socket, 404, "Not Found")
+            return self.error_response(404, "Not Found")
+    
+    def listing_page(self, query):
+        # ?page= is 1-based; ?limit= is capped so a request cannot ask for
+        # a 50k-row page
+        params = urllib.parse.parse_qs(query)
+        try:
+            page = max(1, int(params.get('page', ['1'])[0]))
+        except ValueError:
+            page = 1
+        try:
+            limit = int(params.get('limit', [self.listing_page_size])[0])
+        except ValueError:
+            limit = self.listing_page_size
+        return page, min(max(1, limit), self.max_listing_page_size)
+    
+    def listing_navigation(self, page, page_count, limit):
+        links = []
+        if page > 1:
+            links.append(f'<a href="?page={page - 1}&amp;limit={limit}">Previous</a>')
+        links.append(f'Page {page} of {page_count}')
+        if page < page_count:
+            links.append(f'<a href="?page={page + 1}&amp;limit={limit}">Next</a>')
+        return f'<p>{" | ".join(links)}</p>'
     
     def serve_file(self, client_socket, file_path):
+        self.write_response(client_socket, self.file_response(file_path))
+    
+    def file_response(self, file_path, headers=None, index_entry=None, memory_only=False):
         try:
-            # Determine content type
-            mime_type, _ = mimetypes.guess_type(str(file_path))
+            headers = headers or {}
+            if index_entry is None:
+                index_entry = IndexEntry(os.stat(file_path), self.guess_content_type(file_path), time.monotonic())
+            file_stat = index_entry.stat
+            file_size = file_stat.st_size
+            
+            cache_key = str(file_path)
+            entry = self.content_cache.get(cache_key, file_stat.st_mtime_ns, file_size, not memory_only)
+            mime_type = entry.content_type if entry is not None else index_entry.mime_type
             if mime_type is None:
-                mime_type = 'application/octet-stream'
+                return self.error_response(404, "Not Found")
             
-            # Check if file type is supported
-            supported_types = ['text/html', 'text/plain', 'image/png', 'application/pdf']
-            if mime_type not in supported_types:
-                self.send_response(client_socket, 404, "Not Found")
-                return
+            # Ranges are only served from the identity encoding
+            range_header = headers.get('range')
+            encoding = None
+            if mime_type in COMPRESSIBLE_TYPES and not range_header:
+                encoding = self.negotiate_encoding(headers.get('accept-encoding'))
             
-            with open(file_path, 'rb') as file:
-                content = file.read()
+            # Either representation is a valid copy for the client to reuse
+            etag = self.make_etag(file_stat)
+            etags = [etag] if encoding is None else [etag, self.make_etag(file_stat, encoding)]
+            if self.is_not_modified(headers, etags, file_stat.st_mtime):
+                return Response(304, headers=self.validator_headers(etags[-1], file_stat, mime_type))
             
-            response = f"HTTP/1.1 200 OK\r\n"
-            response += f"Content-Type: {mime_type}\r\n"
-            response += f"Content-Length: {len(content)}\r\n"
-            response += "Connection: close\r\n\r\n"
+            if encoding is not None:
+                response = self.encoded_file_response(file_path, file_stat, mime_type, encoding, memory_only)
+                if response is not None or memory_only:
+                    return response
             
-            client_socket.send(response.encode('utf-8'))
-            client_socket.send(content)
+            if range_header and self.if_range_matches(headers, etag, file_stat.st_mtime):
+                ranges = self.parse_range_header(range_header, file_size)
+                if ranges == []:
+                    return self.error_response(416, "Range Not Satisfiable",
+                                               headers=[('Content-Range', f'bytes */{file_size}')])
+                if ranges:
+                    if memory_only:
+                        return None
+                    return self.partial_file_response(file_path, mime_type, file_size, ranges,
+                                                      self.validator_headers(etag, file_stat, mime_type))
+            
+            if entry is not None:
+                return Response(200, content_type=mime_type, body=entry.body, entity_header=entry.header)
+            if memory_only:
+                return None
+            
+            response_headers = [('Accept-Ranges', 'bytes')] + self.validator_headers(etag, file_stat, mime_type)
+            
+            if file_size <= self.content_cache.max_entry_bytes:
+                with open(file_path, 'rb') as file:
+                    content = file.read()
+                
+                response = Response(200, content_type=mime_type, body=content, headers=response_headers)
+                # Only cache what matches the stat we validate against
+                if len(content) == file_size:
+                    self.content_cache.put(cache_key, CacheEntry(file_stat.st_mtime_ns, file_size, mime_type,
+                                                                 response.entity_header_bytes(), content))
+                return response
+            
+            # Large files are streamed from disk when the response is written
+            return Response(200, content_type=mime_type, file_path=file_path,
+                            segments=[(0, file_size)], headers=response_headers)
             
         except FileNotFoundError:
-            self.send_response(client_socket, 404, "Not Found")
+            return self.error_response(404, "Not Found")
         except Exception as e:
             print(f"Error serving file: {e}")
-            self.send_response(client_socket, 404, "Not Found")
+            return self.error_response(404, "Not Found")
     
-    def send_response(self, client_socket, status_code, status_message):
-        status_map = {
-            200: "OK",
-            404: "Not Found",
-            429: "Too Many Requests"
+    def encoded_file_response(self, file_path, file_stat, mime_type, encoding, memory_only=False):
+        # Compressed variants are cached under their own key but validated
+        # against the source file, so they are rebuilt when it changes.
+        # Returns None when no compressed variant can be produced, or with
+        # memory_only, when it is not cached.
+        cache_key = f"{file_path}|{encoding}"
+        entry = self.content_cache.get(cache_key, file_stat.st_mtime_ns, file_stat.st_size, not memory_only)
+        if entry is not None:
+            return Response(200, content_type=mime_type, body=entry.body, entity_header=entry.header)
+        if memory_only:
+            return None
+        
+        response_headers = [('Content-Encoding', encoding)]
+        response_headers += self.validator_headers(self.make_etag(file_stat, encoding), file_stat, mime_type)
+        
+        # A precompressed sibling (index.html.gz) wins if it is not older
+        # than the file it was made from
+        if encoding == 'gzip':
+            precompressed_path = f"{file_path}.gz"
+            precompressed_entry = self.file_index.lookup(precompressed_path) if self.file_index else None
+            precompressed_stat = precompressed_entry.stat if precompressed_entry is not None else None
+            
+            if precompressed_stat is not None and precompressed_stat.st_mtime_ns >= file_stat.st_mtime_ns:
+                if precompressed_stat.st_size > self.content_cache.max_entry_bytes:
+                    return Response(200, content_type=mime_type, file_path=precompressed_path,
+                                    segments=[(0, precompressed_stat.st_size)], headers=response_headers)
+                
+                with open(precompressed_path, 'rb') as file:
+                    content = file.read()
+                return self.cache_encoded_variant(cache_key, file_stat, mime_type, content, response_headers)
+        
+        if file_stat.st_size > self.content_cache.max_entry_bytes:
+            return None
+        
+        with open(file_path, 'rb') as file:
+            content = file.read()
+        if len(content) != file_stat.st_size:
+            return None
+        
+        return self.cache_encoded_variant(cache_key, file_stat, mime_type,
+                                          self.compress_body(content, encoding), response_headers)
+    
+    def cache_encoded_variant(self, cache_key, file_stat, mime_type, content, response_headers):
+        response = Response(200, content_type=mime_type, body=content, headers=response_headers)
+        self.content_cache.put(cache_key, CacheEntry(file_stat.st_mtime_ns, file_stat.st_size, mime_type,
+                                                     response.entity_header_bytes(), content))
+        return response
+    
+    def negotiate_encoding(self, accept_encoding):
+        # Returns 'gzip', 'deflate' or None for identity
+        if not accept_encoding:
+            return None
+        
+        qualities = {}
+        for item in accept_encoding.split(','):
+            coding, _, params = item.partition(';')
+            quality = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            qualities[coding.strip().lower()] = quality
+        
+        best_encoding, best_quality = None, 0.0
+        for coding in ('gzip', 'deflate'):
+            quality = qualities.get(coding, qualities.get('*', 0.0))
+            if quality > best_quality:
+                best_encoding, best_quality = coding, quality
+        return best_encoding
+    
+    def compress_body(self, body, encoding):
+        if encoding == 'gzip':
+            return gzip.compress(body, compresslevel=6, mtime=0)
+        return zlib.compress(body, 6)
+    
+    def compress_response(self, response, headers):
+        # On-the-fly compression for generated HTML such as listings
+        if response.status_code != 200 or len(response.body) < MIN_COMPRESS_SIZE:
+            return response
+        
+        response.headers.append(('Vary', 'Accept-Encoding'))
+        encoding = self.negotiate_encoding((headers or {}).get('accept-encoding'))
+        if encoding is None:
+            return response
+        
+        return Response(200, content_type=response.content_type,
+                        body=self.compress_body(response.body, encoding),
+                        headers=response.headers + [('Content-Encoding', encoding)])
+    
+    def guess_content_type(self, file_path):
+        # Returns None for types the server does not serve
+        mime_type, content_encoding = mimetypes.guess_type(str(file_path))
+        if content_encoding is not None:
+            # index.html.gz is a precompressed variant, not an HTML file
+            return None
+        if mime_type is None:
+            mime_type = 'application/octet-stream'
+        
+        # Check if file type is supported
+        supported_types = ['text/html', 'text/plain', 'image/png', 'application/pdf']
+        if mime_type not in supported_types:
+            return None
+        return mime_type
+    
+    def make_etag(self, file_stat, encoding=None):
+        # Strong validator: changes whenever the file is replaced or modified,
+        # and differs between the identity and compressed representations
+        etag = f'{file_stat.st_ino:x}-{file_stat.st_size:x}-{file_stat.st_mtime_ns:x}'
+        if encoding is not None:
+            etag += f'-{encoding}'
+        return f'"{etag}"'
+    
+    def validator_headers(self, etag, file_stat, mime_type):
+        headers = [
+            ('ETag', etag),
+            ('Last-Modified', email.utils.formatdate(file_stat.st_mtime, usegmt=True)),
+            ('Cache-Control', f'max-age={self.cache_max_age.get(mime_type, 0)}'),
+        ]
+        if mime_type in COMPRESSIBLE_TYPES:
+            headers.append(('Vary', 'Accept-Encoding'))
+        return headers
+    
+    def is_not_modified(self, headers, etags, mtime):
+        # If-None-Match takes precedence over If-Modified-Since
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None:
+            if if_none_match.strip() == '*':
+                return True
+            candidates = [tag.strip() for tag in if_none_match.split(',')]
+            # GET uses the weak comparison, so W/ prefixes are ignored
+            return any(
+                (tag[2:] if tag.startswith('W/') else tag) in etags
+                for tag in candidates
+            )
+        
+        if_modified_since = headers.get('if-modified-since')
+        if if_modified_since is not None:
+            since = self.parse_http_date(if_modified_since)
+            return since is not None and int(mtime) <= since
+        
+        return False
+    
+    def if_range_matches(self, headers, etag, mtime):
+        # A Range with a stale If-Range validator gets the whole file
+        if_range = headers.get('if-range')
+        if if_range is None:
+            return True
+        if if_range.startswith('"'):
+            return if_range == etag
+        since = self.parse_http_date(if_range)
+        return since is not None and int(mtime) == since
+    
+    def parse_http_date(self, value):
+        try:
+            return int(email.utils.parsedate_to_datetime(value).timestamp())
+        except (TypeError, ValueError):
+            return None
+    
+    def parse_range_header(self, range_header, file_size):
+        # Returns a list of (first, last) byte positions, [] when no range can
+        # be satisfied, or None when the header should be ignored and the
+        # whole file served
+        unit, _, range_set = range_header.partition('=')
+        if unit.strip().lower() != 'bytes':
+            return None
+        
+        ranges = []
+        specs = range_set.split(',')
+        if len(specs) > MAX_RANGES:
+            return None
+        
+        for spec in specs:
+            first, separator, last = spec.strip().partition('-')
+            if not separator:
+                return None
+            
+            try:
+                if not first:
+                    # Suffix range: the last N bytes
+                    suffix_length = int(last)
+                    if suffix_length > 0 and file_size > 0:
+                        ranges.append((max(0, file_size - suffix_length), file_size - 1))
+                    continue
+                
+                first = int(first)
+                last = int(last) if last else None
+            except ValueError:
+                return None
+            
+            if last is not None and first > last:
+                return None
+            if first < file_size:
+                last = file_size - 1 if last is None else min(last, file_size - 1)
+                ranges.append((first, last))
+        
+        return ranges
+    
+    def partial_file_response(self, file_path, mime_type, file_size, ranges, validators):
+        if len(ranges) == 1:
+            first, last = ranges[0]
+            return Response(206, content_type=mime_type, file_path=file_path,
+                            segments=[(first, last - first + 1)],
+                            headers=[('Accept-Ranges', 'bytes'),
+                                     ('Content-Range', f'bytes {first}-{last}/{file_size}')] + validators)
+        
+        # Several ranges go out as multipart/byteranges; part headers are small
+        # in-memory segments between the file slices
+        boundary = uuid.uuid4().hex
+        segments = []
+        for first, last in ranges:
+            part_header = f"\r\n--{boundary}\r\n"
+            part_header += f"Content-Type: {mime_type}\r\n"
+            part_header += f"Content-Range: bytes {first}-{last}/{file_size}\r\n\r\n"
+            segments.append(part_header.encode('utf-8'))
+            segments.append((first, last - first + 1))
+        segments.append(f"\r\n--{boundary}--\r\n".encode('utf-8'))
+        
+        return Response(206, content_type=f'multipart/byteranges; boundary={boundary}',
+                        file_path=file_path, segments=segments,
+                        headers=[('Accept-Ranges', 'bytes')] + validators)
+    
+    def metrics_response(self):
+        # Queue depth and cache stats are per process; counters and
+        # histograms are shared by all pre-fork workers
+        gauges = {
+            'pool_queue_depth': ('Connections waiting for a worker thread.', self.thread_pool.queue_depth()),
+            'pool_workers': ('Worker threads running.', self.thread_pool.workers),
+            'index_entries': ('Paths in the file metadata index.', len(self.file_index.entries)),
+        }
+        if self.connection_poller is not None:
+            gauges['connections_parked'] = ('Connections waiting for request bytes outside the worker pool.',
+                                            self.connection_poller.parked)
+        caches = {
+            'content': self.content_cache.stats(),
+            'listing': self.listing_cache.stats(),
         }
+        if self.bandwidth_limiter is not None:
+            gauges['shaped_clients'] = ('Clients with a response being paced by bandwidth shaping.',
+                                        self.bandwidth_limiter.shaped_clients())
+        counters = {}
+        if self.access_log is not None:
+            counters['access_log_dropped'] = ('Access log records dropped because the buffer was full.',
+                                              self.access_log.dropped)
+        body = self.metrics.render(gauges, caches, counters).encode('utf-8')
+        return Response(200, content_type='text/plain; version=0.0.4; charset=utf-8', body=body,
+                        headers=[('Cache-Control', 'no-store')])
+    
+    def send_response(self, client_socket, status_code, status_message):
+        # Returns the number of bytes sent
+        response = self.error_response(status_code, status_message)
+        bytes_sent = self.write_response(client_socket, response)
+        self.metrics.record_status(status_code, bytes_sent)
+        return bytes_sent
+    
+    def error_response(self, status_code, status_message, headers=None):
+        message = STATUS_MESSAGES.get(status_code, status_message)
+        if headers:
+            body = self.response_writer.status_page(status_code, message)[0]
+            return Response(status_code, status_message=message, body=body, headers=headers)
         
-        message = status_map.get(status_code, status_message)
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>{status_code} {message}</title>
-        </head>
-        <body>
-            <h1>{status_code} {message}</h1>
-        </body>
-        </html>
-        """
+        # Pre-encoded page; only the Response wrapper is new
+        body, entity_header = self.response_writer.status_page(status_code, message)
+        return Response(status_code, status_message=message, body=body, entity_header=entity_header)
+    
+    def write_response(self, client_socket, response, keep_alive=False, requests_served=0, client_ip=None):
+        # Returns the number of bytes sent. With bandwidth shaping on, the
+        # body is paced to client_ip's share
+        header = response.header_bytes(self.connection_header(keep_alive, requests_served))
+        deadline = SendDeadline(self.deadlines)
+        if self.bandwidth_limiter is None:
+            client_ip = None
+        if client_ip is not None:
+            self.bandwidth_limiter.start(client_ip)
+        
+        try:
+            if response.file_path is None:
+                if client_ip is not None:
+                    self.throttle(client_ip, len(response.body), deadline)
+                self.response_writer.send_buffers(client_socket, [header, response.body], deadline)
+                return len(header) + len(response.body)
+            
+            # In-memory pieces (headers, multipart part headers) are gathered
+            # and sent together right before each file slice
+            sent = 0
+            pending = [header]
+            with open(response.file_path, 'rb') as file:
+                for segment in response.segments:
+                    if isinstance(segment, bytes):
+                        pending.append(segment)
+                        continue
+                    
+                    self.response_writer.send_buffers(client_socket, pending, deadline, more=True)
+                    sent += sum(len(buffer) for buffer in pending)
+                    pending = []
+                    offset, length = segment
+                    sent += self.send_file_body(client_socket, file, offset, length, deadline, client_ip)
+                
+                if pending:
+                    self.response_writer.send_buffers(client_socket, pending, deadline)
+                    sent += sum(len(buffer) for buffer in pending)
+            return sent
+        finally:
+            if client_ip is not None:
+                self.bandwidth_limiter.finish(client_ip)
+    
+    def throttle(self, client_ip, count, deadline):
+        # Waits until count more bytes may go to client_ip; returns count
+        delay = self.bandwidth_limiter.reserve(client_ip, count)
+        if delay > 0:
+            time.sleep(delay)
+            deadline.extend(delay)
+            self.metrics.record_throttle(delay)
+        return count
+    
+    def write_response_available(self, connection, response, keep_alive=False, requests_served=0):
+        # Writes an in-memory response without blocking; what the socket
+        # buffer cannot take is left for a worker. Returns the response size
+        header = response.header_bytes(self.connection_header(keep_alive, requests_served))
+        if self.bandwidth_limiter is not None:
+            # Booked without waiting; serve_request hands clients that are
+            # over their budget to a worker
+            self.bandwidth_limiter.reserve(connection.address[0], len(response.body))
+        unsent = self.response_writer.send_available(connection.socket, [header, response.body])
+        if unsent:
+            connection.pending_output = (unsent, keep_alive)
+        return len(header) + len(response.body)
+    
+    def send_file_body(self, client_socket, file, offset, count, deadline, client_ip=None):
+        # Stream from the file descriptor so the body never lands in the
+        # Python heap; memory per request stays flat for any file size.
+        # With client_ip the body is shaped a FILE_CHUNK_SIZE at a time
+        if hasattr(os, 'sendfile'):
+            sent = self.send_file_zero_copy(client_socket, file, offset, count, deadline, client_ip)
+        else:
+            sent = self.send_file_buffered(client_socket, file, offset, count, deadline, client_ip)
+        
+        # Content-Length has already been sent, so a short body (the file
+        # shrank underneath us) can only be signalled by dropping the socket
+        if sent < count:
+            raise ConnectionError(f"Sent {sent} of {count} bytes of {file.name}")
+        return sent
+    
+    def send_file_zero_copy(self, client_socket, file, offset, count, deadline, client_ip=None):
+        # os.sendfile on the non-blocking descriptor, with poll() while the
+        # socket buffer is full. socket.sendfile restarts its timeout on
+        # every wait, so a client taking a few bytes at a time would never
+        # miss the deadline.
+        deadline.arm(client_socket)
+        writable = select.poll()
+        writable.register(client_socket, select.POLLOUT)
+        socket_fd = client_socket.fileno()
+        file_fd = file.fileno()
+        sent = 0
+        # Bytes that may be sent before throttling again
+        allowed = count if client_ip is None else 0
         
-        response = f"HTTP/1.1 {status_code} {message}\r\n"
-        response += "Content-Type: text/html; charset=utf-8\r\n"
-        response += f"Content-Length: {len(html_content.encode('utf-8'))}\r\n"
-        response += "Connection: close\r\n\r\n"
-        response += html_content
+        while sent < count:
+            if sent == allowed:
+                allowed += self.throttle(client_ip, min(FILE_CHUNK_SIZE, count - sent), deadline)
+            try:
+                chunk = os.sendfile(socket_fd, file_fd, offset + sent, allowed - sent)
+            except BlockingIOError:
+                if not writable.poll(deadline.remaining() * 1000):
+                    raise DeadlineExceeded(deadline.kind)
+                continue
+            if not chunk:
+                break
+            sent += chunk
+            deadline.sent += chunk
         
-        client_socket.send(response.encode('utf-8'))
+        return sent
+    
+    def send_file_buffered(self, client_socket, file, offset, count, deadline, client_ip=None):
+        buffer = memoryview(bytearray(FILE_CHUNK_SIZE))
+        file.seek(offset)
+        sent = 0
+        
+        while sent < count:
+            if client_ip is not None:
+                self.throttle(client_ip, min(FILE_CHUNK_SIZE, count - sent), deadline)
+            read = file.readinto(buffer[:min(FILE_CHUNK_SIZE, count - sent)])
+            if not read:
+                break
+            deadline.arm(client_socket, read)
+            try:
+                client_socket.sendall(buffer[:read])
+            except socket.timeout:
+                raise DeadlineExceeded(deadline.kind)
+            sent += read
+            deadline.sent += read
+        
+        return sent
 
 class SingleThreadedHTTPServer(HTTPServer):
+    def __init__(self, host='0.0.0.0', port=8080, **kwargs):
+        super().__init__(host, port, **kwargs)
+        # An idle kept-alive connection would block every other client
+        self.max_keepalive_requests = 1
+    
     def serve_directory(self, base_directory):
-        self.base_directory = Path(base_directory).resolve()
-        print(f"Serving directory: {self.base_directory}")
+        self.open_base_directory(base_directory)
         
         try:
             self.socket.bind((self.host, self.port))
-            self.socket.listen(5)
+            self.socket.listen(self.listen_backlog)
             print(f"Single-threaded server running on http://{self.host}:{self.port}")
             
             while True:
                 client_socket, client_address = self.socket.accept()
-                print(f"Connection from {client_address}")
-                self.handle_client(client_socket, client_address)
+                self.handle_client(self.accept_connection(client_socket, client_address))
                 client_socket.close()
                 
         except KeyboardInterrupt:
             print("\nShutting down server...")
         finally:
             self.socket.close()
+            self.close_access_log()
+
+
+class HybridHTTPServer(HTTPServer):
+    # Requests that can be answered from memory (cached files, 304s, 429s,
+    # cached listings, error pages) are parsed and answered right in the
+    # poller thread, without a queue hop or a context switch. Only those
+    # that need the disk (cold files, large and ranged transfers) go to
+    # the worker pool. The simulated delay stands for that disk work and is
+    # only applied on the pool path.
+    def __init__(self, host='0.0.0.0', port=8080, **kwargs):
+        super().__init__(host, port, **kwargs)
+        # The next request may well be a cache hit
+        self.return_to_poller = True
+    
+    def dispatch_connection(self, connection):
+        keep_open = self.serve_inline(connection)
+        if keep_open is None:
+            self.metrics.increment('dispatch\tpool')
+            super().dispatch_connection(connection)
+        elif keep_open:
+            self.connection_poller.watch(connection)
+        else:
+            connection.socket.close()
+    
+    def serve_inline(self, connection):
+        # Returns True to wait for more bytes, False to close the connection
+        # and None when a worker has to take over
+        client_address = connection.address
+        try:
+            while True:
+                request = self.read_request(connection)
+                if request is None:
+                    return False
+                
+                keep_alive = self.serve_request(connection, request, memory_only=True)
+                if keep_alive is None:
+                    return None
+                self.metrics.increment('dispatch\tinline')
+                if connection.pending_output is not None:
+                    return None
+                if not keep_alive:
+                    return False
+                
+        except BlockingIOError:
+            return True
+        except HTTPParseError as e:
+            # Error pages are small; the parser may have consumed the bad
+            # head already, so answer here rather than in a worker
+            response = self.error_response(e.status_code, str(e))
+            data = response.header_bytes() + response.body
+            self.send_nonblocking(connection.socket, data)
+            self.metrics.record_status(e.status_code, len(data))
+            self.log_access(client_address[0], None, e.status_code, len(data), time.perf_counter())
+        except ConnectionError:
+            pass
+        except Exception as e:
+            print(f"Error handling client: {e}")
+        return False
+
+
+class EventLoopHTTPServer(HTTPServer):
+    # Non-blocking sockets driven by an asyncio event loop: an idle or slow
+    # connection costs a coroutine instead of a pool worker, so thousands of
+    # connections can be open at once. Routing, listings, counters and rate
+    # limiting are the same as in HTTPServer.
+    def __init__(self, host='0.0.0.0', port=8080, listen_backlog=1024, **kwargs):
+        super().__init__(host, port, listen_backlog=listen_backlog, **kwargs)
+    
+    def serve_directory(self, base_directory):
+        self.open_base_directory(base_directory)
+        
+        try:
+            self.socket.bind((self.host, self.port))
+            self.socket.listen(self.listen_backlog)
+            self.socket.setblocking(False)
+            print(f"Event-loop server running on http://{self.host}:{self.port}")
+            
+            asyncio.run(self.run_event_loop())
+                
+        except KeyboardInterrupt:
+            print("\nShutting down server...")
+        finally:
+            self.thread_pool.shutdown()
+            self.socket.close()
+            self.close_access_log()
+    
+    async def run_event_loop(self):
+        server = await asyncio.start_server(self.handle_connection, sock=self.socket)
+        async with server:
+            await server.serve_forever()
+    
+    async def handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        if self.console_log:
+            print(f"Connection from {client_address}")
+        # asyncio only sets TCP_NODELAY when the socket's proto is
+        # IPPROTO_TCP, and ours is created with proto 0
+        client_socket = writer.get_extra_info('socket')
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = ClientConnection(client_socket, client_address, self.create_parser(), self.deadlines)
+        
+        try:
+            while True:
+                request = await self.read_request_async(reader, connection)
+                if request is None:
+                    return
+                
+                connection.requests_served += 1
+                requests_served = connection.requests_served
+                keep_alive = self.should_keep_alive(request, requests_served)
+                
+                self.metrics.request_started()
+                received = time.perf_counter()
+                try:
+                    lookup_seconds = 0.0
+                    response, full_path = self.resolve_request(request.method, request.path, client_address[0])
+                    if response is None:
+                        # Simulated work must not block the loop
+                        await asyncio.sleep(self.simulated_delay)
+                        
+                        started = time.perf_counter()
+                        # Cached files and listings are answered on the loop;
+                        # disk reads, gzip and directory scans go to a thread
+                        response = self.build_response(full_path, request.path, request.headers, request.query,
+                                                       memory_only=True)
+                        if response is None:
+                            response = await asyncio.get_running_loop().run_in_executor(
+                                None, self.build_response, full_path, request.path, request.headers, request.query)
+                        lookup_seconds = time.perf_counter() - started
+                    
+                    started = time.perf_counter()
+                    bytes_sent = await self.write_response_async(writer, response, keep_alive, requests_served,
+                                                                 SendDeadline(self.deadlines), client_address[0])
+                    self.metrics.record_request(request.path, response.status_code, request.parse_seconds,
+                                                lookup_seconds, time.perf_counter() - started, bytes_sent)
+                    self.log_access(client_address[0], request, response.status_code, bytes_sent, received)
+                finally:
+                    self.metrics.request_finished()
+                
+                connection.response_finished()
+                if not keep_alive:
+                    return
+            
+        except DeadlineExceeded as e:
+            if self.record_deadline(connection, e.kind):
+                writer.write(self.timeout_response_bytes)
+            elif e.kind in ('response', 'send_rate'):
+                # abort() alone still closes gracefully, leaving the kernel
+                # send buffer to drain; SO_LINGER 0 makes it a reset
+                writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                                           struct.pack('ii', 1, 0))
+                writer.transport.abort()
+        except HTTPParseError as e:
+            bytes_sent = await self.write_response_async(writer, self.error_response(e.status_code, str(e)))
+            self.metrics.record_status(e.status_code, bytes_sent)
+            self.log_access(client_address[0], None, e.status_code, bytes_sent, time.perf_counter())
+        except ConnectionError:
+            return
+        except Exception as e:
+            print(f"Error handling client: {e}")
+            try:
+                await self.write_response_async(writer, self.error_response(404, "Not Found"))
+            except Exception:
+                pass
+        finally:
+            writer.close()
+    
+    async def read_request_async(self, reader, connection):
+        parser = connection.parser
+        while True:
+            started = time.perf_counter()
+            request = parser.next_request()
+            if request is not None:
+                request.parse_seconds = time.perf_counter() - started
+                return request
+            
+            kind, deadline = connection.read_deadline()
+            try:
+                data = await asyncio.wait_for(reader.read(65536), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(kind)
+            if not data:
+                return None
+            parser.feed(data)
+            connection.bytes_received()
+    
+    async def write_response_async(self, writer, response, keep_alive=False, requests_served=0, deadline=None,
+                                   client_ip=None):
+        # Returns the number of bytes sent. A slow reader only costs a
+        # coroutine here, so the deadline is checked per write (or per file
+        # slice) rather than per socket send
+        header = response.header_bytes(self.connection_header(keep_alive, requests_served))
+        if self.bandwidth_limiter is None or deadline is None:
+            client_ip = None
+        if client_ip is not None:
+            self.bandwidth_limiter.start(client_ip)
+        
+        try:
+            if response.file_path is None:
+                if client_ip is not None:
+                    await self.throttle_async(client_ip, len(response.body), deadline)
+                # One write, so header and body leave in the same segment
+                writer.writelines([header, response.body])
+                await self.wait_sent(writer.drain(), deadline, len(header) + len(response.body))
+                return len(header) + len(response.body)
+            
+            # loop.sendfile uses os.sendfile when it can and falls back to
+            # chunked reads and writes otherwise
+            writer.write(header)
+            loop = asyncio.get_running_loop()
+            total = len(header)
+            with open(response.file_path, 'rb') as file:
+                for segment in response.segments:
+                    if isinstance(segment, bytes):
+                        writer.write(segment)
+                        total += len(segment)
+                        continue
+                    
+                    offset, length = segment
+                    if client_ip is None:
+                        sent = await self.wait_sent(loop.sendfile(writer.transport, file, offset, length),
+                                                    deadline, length)
+                    else:
+                        sent = 0
+                        while sent < length:
+                            count = await self.throttle_async(client_ip, min(FILE_CHUNK_SIZE, length - sent), deadline)
+                            chunk = await self.wait_sent(loop.sendfile(writer.transport, file, offset + sent, count),
+                                                         deadline, count)
+                            sent += chunk
+                            if chunk < count:
+                                break
+                    if sent < length:
+                        raise ConnectionError(f"Sent {sent} of {length} bytes of {response.file_path}")
+                    total += sent
+            
+            await self.wait_sent(writer.drain(), deadline)
+            return total
+        finally:
+            if client_ip is not None:
+                self.bandwidth_limiter.finish(client_ip)
+    
+    async def wait_sent(self, write, deadline, count=0):
+        # Awaits a write of count bytes within the response deadlines
+        if deadline is None:
+            return await write
+        try:
+            timeout = deadline.remaining(count)
+        except DeadlineExceeded:
+            write.close()
+            raise
+        try:
+            result = await asyncio.wait_for(write, timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(deadline.kind)
+        deadline.sent += count
+        return result
+    
+    async def throttle_async(self, client_ip, count, deadline):
+        delay = self.bandwidth_limiter.reserve(client_ip, count)
+        if delay > 0:
+            await asyncio.sleep(delay)
+            deadline.extend(delay)
+            self.metrics.record_throttle(delay)
+        return count
+
+
+class PreforkSupervisor:
+    # Forks `workers` server processes that each accept on their own
+    # SO_REUSEPORT socket, which sidesteps the GIL by using one process per
+    # core. Request counters and rate-limit state are created here, before
+    # forking, in shared memory, so listings and per-IP limits are global.
+    # Workers that die are restarted.
+    def __init__(self, server_class, server_options, workers):
+        self.server_class = server_class
+        self.server_options = server_options
+        self.workers = workers
+        self.request_counters = SharedCounterTable()
+        self.metrics_counters = SharedCounterTable(capacity=8192)
+        self.rate_limiter = SharedRateLimiter(
+            RATE_LIMITERS[server_options.get('rate_limit_algorithm', 'sliding-window')](
+                limit=server_options.get('rate_limit', 10),
+                window=server_options.get('rate_limit_window', 1.0),
+                burst=server_options.get('rate_limit_burst'),
+                sweep_interval=None,
+            )
+        )
+        self.children = {}
+        self.shutting_down = False
+    
+    def spawn_worker(self, worker_id, base_directory):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = worker_id
+            return
+        
+        # Worker process
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            server_options = dict(self.server_options)
+            access_log = server_options.get('access_log')
+            if access_log and access_log != '-':
+                # Each worker writes and rotates its own file
+                server_options['access_log'] = f"{access_log}.worker{worker_id}"
+            server = self.server_class(request_counters=self.request_counters, rate_limiter=self.rate_limiter,
+                                       metrics_counters=self.metrics_counters, reuse_port=True,
+                                       **server_options)
+            print(f"Worker {worker_id} started (pid {os.getpid()})")
+            server.serve_directory(base_directory)
+        except KeyboardInterrupt:
+            pass
+        except BaseException as e:
+            print(f"Worker {worker_id} crashed: {e}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+    
+    def serve_directory(self, base_directory):
+        # docker stop sends SIGTERM; treat it like Ctrl-C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        print(f"Starting {self.workers} worker processes...")
+        for worker_id in range(self.workers):
+            self.spawn_worker(worker_id, base_directory)
+        
+        try:
+            while self.children:
+                pid, status = os.wait()
+                worker_id = self.children.pop(pid, None)
+                if worker_id is None or self.shutting_down:
+                    continue
+                
+                # A worker killed in the middle of an update still holds its
+                # stripe locks; release them or the others would wait on them
+                for table in (self.request_counters, self.metrics_counters, self.rate_limiter):
+                    released = table.locks.release_dead(pid)
+                    if released:
+                        print(f"Released {released} shared locks held by worker {worker_id}")
+                
+                print(f"Worker {worker_id} (pid {pid}) exited with status {status}, restarting")
+                # Back off a little so a worker that dies on startup does not spin
+                time.sleep(1)
+                self.spawn_worker(worker_id, base_directory)
+        except KeyboardInterrupt:
+            print("\nShutting down workers...")
+            self.shutting_down = True
+            for pid in list(self.children):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            for pid in list(self.children):
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
 
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python server.py <directory>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Serve a directory over HTTP")
+    parser.add_argument('directory')
+    parser.add_argument('--rate-limit', type=int, default=10,
+                        help="requests allowed per client per window (default: 10)")
+    parser.add_argument('--rate-window', type=float, default=1.0,
+                        help="rate limit window in seconds (default: 1.0)")
+    parser.add_argument('--rate-burst', type=int, default=None,
+                        help="token bucket capacity (default: same as --rate-limit)")
+    parser.add_argument('--rate-algorithm', choices=sorted(RATE_LIMITERS), default='sliding-window')
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of pre-forked worker processes (default: 1, no pre-forking)")
+    parser.add_argument('--pool-size', type=int, default=10,
+                        help="worker threads per process (default: 10)")
+    parser.add_argument('--max-pool-size', type=int, default=None,
+                        help="let the pool grow up to this many threads when requests queue up")
+    parser.add_argument('--queue-size', type=int, default=100,
+                        help="connections waiting for a worker, per scheduling class, before new ones "
+                             "get 503 (default: 100)")
+    parser.add_argument('--bulk-workers', type=int, default=None,
+                        help="most worker threads serving files over 1 MiB at once (default: half the pool)")
+    parser.add_argument('--backlog', type=int, default=None,
+                        help="listen backlog (default: 128, 1024 for the event loop)")
+    parser.add_argument('--access-log', metavar='PATH', default=None,
+                        help="write an access log to PATH ('-' for stdout)")
+    parser.add_argument('--access-log-format', choices=AccessLog.FORMATS, default='combined')
+    parser.add_argument('--access-log-max-bytes', type=int, default=10 * 1024 * 1024,
+                        help="rotate the access log past this size (default: 10 MiB)")
+    parser.add_argument('--index-poll-interval', type=float, default=1.0,
+                        help="seconds between checks for changed files when inotify is not available (default: 1)")
+    parser.add_argument('--header-timeout', type=float, default=10,
+                        help="seconds a client has to send a whole request head (default: 10)")
+    parser.add_argument('--idle-timeout', type=float, default=5,
+                        help="seconds a kept-alive connection may wait for its next request (default: 5)")
+    parser.add_argument('--response-timeout', type=float, default=300,
+                        help="seconds allowed for writing one response (default: 300)")
+    parser.add_argument('--min-send-rate', type=int, default=4096,
+                        help="drop clients that read a response slower than this many bytes/second, "
+                             "after 10s of grace (default: 4096, 0 to disable)")
+    parser.add_argument('--client-bandwidth', type=int, default=None,
+                        help="most response bytes/second sent to one client IP (default: unlimited)")
+    parser.add_argument('--total-bandwidth', type=int, default=None,
+                        help="most response bytes/second in total, split evenly among downloading clients "
+                             "(default: unlimited)")
+    parser.add_argument('--bandwidth-burst', type=int, default=256 * 1024,
+                        help="bytes a client may send above its rate in a burst (default: 262144)")
+    parser.add_argument('--quiet', action='store_true',
+                        help="don't print a line per connection and request")
+    args = parser.parse_args()
     
-    directory = sys.argv[1]
+    directory = args.directory
     if not os.path.isdir(directory):
         print(f"Error: {directory} is not a directory")
         sys.exit(1)
 
     # Default server type
-    default_server_type = "1"  # 1 = multithreaded, 2 = single-threaded
+    default_server_type = "1"  # 1 = multithreaded, 2 = single-threaded, 3 = event loop, 4 = hybrid
 
     # Use environment variable to decide default vs interactive
     use_defaults = os.environ.get("USE_DEFAULTS", "0").lower() in ("1", "true", "yes")
@@ -310,15 +3345,56 @@ def main():
         print("Choose server type:")
         print("1. Multithreaded (default)")
         print("2. Single-threaded")
-        choice = input("Enter choice (1 or 2): ").strip() or default_server_type
+        print("3. Event loop (asyncio)")
+        print("4. Hybrid (cache hits served in the accept loop, disk reads in the pool)")
+        choice = input("Enter choice (1, 2, 3 or 4): ").strip() or default_server_type
+
+    server_options = {
+        'rate_limit': args.rate_limit,
+        'rate_limit_window': args.rate_window,
+        'rate_limit_burst': args.rate_burst,
+        'rate_limit_algorithm': args.rate_algorithm,
+        'pool_size': args.pool_size,
+        'max_pool_size': args.max_pool_size,
+        'max_queue_size': args.queue_size,
+        'bulk_workers': args.bulk_workers,
+        'access_log': args.access_log,
+        'access_log_format': args.access_log_format,
+        'access_log_max_bytes': args.access_log_max_bytes,
+        'console_log': not args.quiet,
+        'index_poll_interval': args.index_poll_interval,
+        'header_timeout': args.header_timeout,
+        'idle_timeout': args.idle_timeout,
+        'response_timeout': args.response_timeout,
+        'min_send_rate': args.min_send_rate,
+        'client_bandwidth': args.client_bandwidth,
+        'total_bandwidth': args.total_bandwidth,
+        'bandwidth_burst': args.bandwidth_burst,
+    }
+    if args.backlog is not None:
+        server_options['listen_backlog'] = args.backlog
 
     if choice == "2":
-        server = SingleThreadedHTTPServer()
+        server_class = SingleThreadedHTTPServer
         print("Starting single-threaded server...")
+    elif choice == "3":
+        server_class = EventLoopHTTPServer
+        print("Starting event-loop server...")
+    elif choice == "4":
+        server_class = HybridHTTPServer
+        print("Starting hybrid-dispatch server...")
     else:
-        server = HTTPServer()
+        server_class = HTTPServer
         print("Starting multithreaded server...")
 
+    if args.workers > 1:
+        if not hasattr(os, 'fork') or not hasattr(socket, 'SO_REUSEPORT'):
+            print("Error: --workers needs os.fork and SO_REUSEPORT (Linux/BSD)")
+            sys.exit(1)
+        server = PreforkSupervisor(server_class, server_options, args.workers)
+    else:
+        server = server_class(**server_options)
+
     server.serve_directory(directory)
 
 if __name__ == "__main__":
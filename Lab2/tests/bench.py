@@ -0,0 +1,324 @@
+import sys
+import os
+import argparse
+import asyncio
+import json
+import math
+import socket
+import threading
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import server
+
+# Server modes that can be started in-process; new modes only need an entry here
+SERVER_CLASSES = {
+    'single': server.SingleThreadedHTTPServer,
+    'threaded': server.HTTPServer,
+    'event-loop': server.EventLoopHTTPServer,
+    'hybrid': server.HybridHTTPServer,
+}
+
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'content')
+
+# Metrics compared by --baseline, and whether a higher value is better
+COMPARED_METRICS = [
+    ('throughput_rps', True),
+    ('ok_throughput_rps', True),
+    ('latency_ms.p50', False),
+    ('latency_ms.p90', False),
+    ('latency_ms.p99', False),
+]
+
+def start_server(mode, directory, delay, rate_limit):
+    # Runs the server in a daemon thread on an ephemeral port and returns the port
+    instance = SERVER_CLASSES[mode](host='127.0.0.1', port=0, rate_limit=rate_limit, console_log=False)
+    if delay is not None:
+        instance.simulated_delay = delay
+    threading.Thread(target=instance.serve_directory, args=(directory,), daemon=True).start()
+    
+    # The port is known after bind() but connections are refused until
+    # listen(), so wait until a test connection gets through
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            port = instance.socket.getsockname()[1]
+            if port:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return port
+        except OSError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{mode} server did not start")
+
+class Connection:
+    # One HTTP/1.1 connection; reused between requests when keep_alive is set
+    def __init__(self, host, port, keep_alive):
+        self.host = host
+        self.port = port
+        self.keep_alive = keep_alive
+        self.reader = None
+        self.writer = None
+    
+    async def get(self, path):
+        # Returns the status code
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        
+        connection = 'keep-alive' if self.keep_alive else 'close'
+        self.writer.write(f"GET {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                          f"Connection: {connection}\r\n\r\n".encode('utf-8'))
+        try:
+            head = await self.reader.readuntil(b"\r\n\r\n")
+            lines = head.decode('iso-8859-1').split('\r\n')
+            status_code = int(lines[0].split()[1])
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            
+            if 'content-length' in headers:
+                await self.reader.readexactly(int(headers['content-length']))
+            else:
+                await self.reader.read()
+        except BaseException:
+            self.close()
+            raise
+        
+        if not self.keep_alive or 'close' in headers.get('connection', '').lower():
+            self.close()
+        return status_code
+    
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+class LoadGenerator:
+    def __init__(self, host, port, paths, timeout, keep_alive):
+        self.host = host
+        self.port = port
+        self.paths = paths
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        # (start, latency, status): start relative to the run start; status
+        # is None for connection errors and timeouts
+        self.results = []
+        self.sent = 0
+    
+    async def request(self, connection, scheduled):
+        # Latency is measured from the scheduled start, so a server that
+        # falls behind an open-loop schedule is charged for the wait too
+        path = self.paths[self.sent % len(self.paths)]
+        self.sent += 1
+        try:
+            status_code = await asyncio.wait_for(connection.get(path), self.timeout)
+        except (OSError, ValueError, IndexError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            connection.close()
+            status_code = None
+        self.results.append((scheduled - self.started, time.perf_counter() - scheduled, status_code))
+    
+    async def closed_loop(self, concurrency, run_time):
+        # Fixed number of clients, each sending its next request as soon as
+        # the previous one completes
+        self.started = time.perf_counter()
+        deadline = self.started + run_time
+        
+        async def client():
+            connection = Connection(self.host, self.port, self.keep_alive)
+            while time.perf_counter() < deadline:
+                await self.request(connection, time.perf_counter())
+            connection.close()
+        
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+    
+    async def open_loop(self, rate, run_time):
+        # Requests start at a constant rate whatever the server's latency,
+        # each on its own connection unless keep-alive is on and one is idle
+        self.started = time.perf_counter()
+        idle = []
+        tasks = []
+        
+        async def one_request(scheduled):
+            connection = idle.pop() if idle else Connection(self.host, self.port, self.keep_alive)
+            await self.request(connection, scheduled)
+            if connection.writer is not None:
+                idle.append(connection)
+        
+        for index in range(int(rate * run_time)):
+            scheduled = self.started + index / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(one_request(scheduled)))
+        
+        await asyncio.gather(*tasks)
+        for connection in idle:
+            connection.close()
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def latency_summary(latencies):
+    latencies = sorted(latency * 1000 for latency in latencies)
+    summary = {
+        'p50': percentile(latencies, 0.50),
+        'p90': percentile(latencies, 0.90),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else None,
+        'mean': sum(latencies) / len(latencies) if latencies else None,
+    }
+    return {name: None if value is None else round(value, 3) for name, value in summary.items()}
+
+def build_report(results, warmup, duration, config):
+    # Requests started during the warm-up are not reported
+    measured = [(start - warmup, latency, status) for start, latency, status in results if start >= warmup]
+    
+    status_counts = {}
+    for _, _, status in measured:
+        key = 'error' if status is None else str(status)
+        status_counts[key] = status_counts.get(key, 0) + 1
+    ok = sum(1 for _, _, status in measured if status is not None and status < 400)
+    
+    buckets = [[] for _ in range(int(duration + 0.999))]
+    for start, latency, status in measured:
+        if int(start) < len(buckets):
+            buckets[int(start)].append((latency, status))
+    
+    timeline = []
+    for second, bucket in enumerate(buckets):
+        ok_latencies = [latency for latency, status in bucket if status is not None and status < 400]
+        timeline.append({
+            'second': second,
+            'requests': len(bucket),
+            'ok': len(ok_latencies),
+            'rate_limited': sum(1 for _, status in bucket if status == 429),
+            'errors': sum(1 for _, status in bucket if status is None),
+            'latency_ms': latency_summary(ok_latencies),
+        })
+    
+    return {
+        'config': config,
+        'requests': len(measured),
+        'ok': ok,
+        'rate_limited': status_counts.get('429', 0),
+        'errors': status_counts.get('error', 0),
+        'status_counts': status_counts,
+        'throughput_rps': round(len(measured) / duration, 2),
+        'ok_throughput_rps': round(ok / duration, 2),
+        'latency_ms': latency_summary([latency for _, latency, status in measured
+                                       if status is not None and status < 400]),
+        'timeline': timeline,
+    }
+
+def metric_value(report, name):
+    value = report
+    for part in name.split('.'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+def compare(report, baseline, max_regression):
+    # Returns the metrics that got worse than the baseline by more than max_regression
+    regressions = []
+    print(f"\n{'metric':<20}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, higher_is_better in COMPARED_METRICS:
+        old, new = metric_value(baseline, name), metric_value(report, name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        print(f"{name:<20}{old:>12.2f}{new:>12.2f}{change:>+10.1%}")
+        if (-change if higher_is_better else change) > max_regression:
+            regressions.append(name)
+    return regressions
+
+def print_summary(report):
+    latency = report['latency_ms']
+    print(f"Requests: {report['requests']}, ok: {report['ok']}, 429: {report['rate_limited']}, "
+          f"errors: {report['errors']}, status codes: {report['status_counts']}")
+    print(f"Throughput: {report['throughput_rps']} req/s ({report['ok_throughput_rps']} ok req/s)")
+    print(f"Latency ms: p50 {latency['p50']}, p90 {latency['p90']}, p99 {latency['p99']}, max {latency['max']}")
+    print("Timeline:")
+    for point in report['timeline']:
+        print(f"  {point['second']:>4}s  {point['requests']:>6} req  {point['ok']:>6} ok  "
+              f"{point['rate_limited']:>5} 429  {point['errors']:>5} err  p99 {point['latency_ms']['p99']} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test one of the servers, or a running one with --url")
+    parser.add_argument('--server', choices=sorted(SERVER_CLASSES), default='threaded',
+                        help="server mode to start in-process on an ephemeral port (default: threaded)")
+    parser.add_argument('--url', help="benchmark an already running server at this base URL instead")
+    parser.add_argument('--directory', default=DEFAULT_DIRECTORY, help="directory served by the in-process server")
+    parser.add_argument('--delay', type=float, default=None,
+                        help="simulated work per request in the in-process server (default: the server's 1s)")
+    parser.add_argument('--rate-limit', type=int, default=1000000,
+                        help="per-client rate limit of the in-process server (default: effectively off)")
+    parser.add_argument('--path', action='append', dest='paths',
+                        help="request path, may be repeated (default: /index.html)")
+    parser.add_argument('--mode', choices=['closed', 'open'], default='closed',
+                        help="closed: fixed concurrency; open: constant arrival rate")
+    parser.add_argument('--concurrency', type=int, default=10, help="clients in closed-loop mode (default: 10)")
+    parser.add_argument('--rate', type=float, default=20, help="requests per second in open-loop mode (default: 20)")
+    parser.add_argument('--duration', type=float, default=10, help="measured seconds (default: 10)")
+    parser.add_argument('--warmup', type=float, default=2, help="seconds of load before measuring (default: 2)")
+    parser.add_argument('--timeout', type=float, default=30, help="per-request timeout in seconds (default: 30)")
+    parser.add_argument('--keep-alive', action='store_true', help="reuse connections between requests")
+    parser.add_argument('--output', help="write the JSON report to this file")
+    parser.add_argument('--baseline', help="compare against an earlier JSON report")
+    parser.add_argument('--max-regression', type=float, default=0.10,
+                        help="with --baseline, fail when a metric is this much worse (default: 0.10)")
+    args = parser.parse_args()
+    
+    paths = args.paths or ['/index.html']
+    if args.url:
+        url = urllib.parse.urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+        paths = [url.path.rstrip('/') + path for path in paths]
+        target = args.url
+    else:
+        host, port = '127.0.0.1', start_server(args.server, args.directory, args.delay, args.rate_limit)
+        target = args.server
+    
+    config = {
+        'target': target,
+        'mode': args.mode,
+        'concurrency': args.concurrency if args.mode == 'closed' else None,
+        'rate': args.rate if args.mode == 'open' else None,
+        'duration': args.duration,
+        'warmup': args.warmup,
+        'paths': paths,
+        'keep_alive': args.keep_alive,
+        'delay': args.delay,
+        'rate_limit': None if args.url else args.rate_limit,
+    }
+    print(f"Benchmarking {target} ({args.mode} loop) for {args.warmup}s warm-up + {args.duration}s")
+    
+    generator = LoadGenerator(host, port, paths, args.timeout, args.keep_alive)
+    run_time = args.warmup + args.duration
+    if args.mode == 'closed':
+        asyncio.run(generator.closed_loop(args.concurrency, run_time))
+    else:
+        asyncio.run(generator.open_loop(args.rate, run_time))
+    
+    report = build_report(generator.results, args.warmup, args.duration, config)
+    print_summary(report)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.max_regression)
+        if regressions:
+            print(f"Regression in: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import sys
+import os
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from server import ShardedCounter
+
+NUM_WORKERS = 64  # test2.py uses 50 concurrent requests
+INCREMENTS_PER_WORKER = 20000
+PATHS = ["/app/content/index.html", "/app/content/monalisa.png", "/app/content/pr.pdf"]
+
+class GlobalLockCounter:
+    # The previous implementation: one lock around a shared dict, with the
+    # "Updated ..." print done while holding it
+    def __init__(self, log_file=None):
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.log_file = log_file
+    
+    def increment(self, key):
+        with self.lock:
+            if key in self.counts:
+                self.counts[key] += 1
+            else:
+                self.counts[key] = 1
+            if self.log_file is not None:
+                print(f"Updated {key} to {self.counts[key]}", file=self.log_file)
+    
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+def run(counter):
+    start_barrier = threading.Barrier(NUM_WORKERS + 1)
+    
+    def worker(index):
+        start_barrier.wait()
+        for i in range(INCREMENTS_PER_WORKER):
+            counter.increment(PATHS[(index + i) % len(PATHS)])
+    
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(NUM_WORKERS)]
+    for t in threads:
+        t.start()
+    
+    start_barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    
+    total = sum(counter.snapshot().values())
+    expected = NUM_WORKERS * INCREMENTS_PER_WORKER
+    return elapsed, total, expected
+
+def main():
+    with open(os.devnull, 'w') as devnull:
+        counters = [
+            ("global lock + print", GlobalLockCounter(log_file=devnull)),
+            ("global lock", GlobalLockCounter()),
+            ("sharded", ShardedCounter()),
+        ]
+        for name, counter in counters:
+            elapsed, total, expected = run(counter)
+            status = "exact" if total == expected else f"LOST {expected - total}"
+            print(f"{name:20} {NUM_WORKERS} workers: {expected / elapsed:12,.0f} increments/s  ({total}/{expected}, {status})")
+
+if __name__ == "__main__":
+    main()